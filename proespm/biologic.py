@@ -0,0 +1,77 @@
+"""biologic.py
+
+Part of proespm: Reader for Biologic EC-Lab ASCII (mpt) files.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import re
+import codecs
+import numpy as np
+import pandas
+
+
+class MptFile(object):
+    """Represents a Biologic EC-Lab ASCII file.
+
+    The header is parsed once when the object is created, the numeric data
+    is read on request.
+
+    Args:
+        m_file (str): Path to the mpt file.
+    """
+
+    encoding = "cp1252"
+
+    def __init__(self, m_file):
+        self.m_file = m_file
+        self.header = []
+        with codecs.open(m_file, encoding=self.encoding) as f:
+            self.header.append(f.readline())
+            self.header.append(f.readline())
+            self.skiprows = int(
+                re.search(r"lines\s:\s*(\d*)\s*", self.header[1]).group(1)
+            )
+            for _ in range(self.skiprows - 3):
+                self.header.append(f.readline())
+            self.columns = f.readline().rstrip("\r\n").split("\t")
+
+    def technique(self):
+        """Returns the name of the EC-Lab technique, e.g. 'Cyclic Voltammetry'."""
+
+        return self.header[3].strip() if len(self.header) > 3 else ""
+
+    def read_columns(self, usecols, chunk_size=2**16):
+        """Reads numeric columns of the data section.
+
+        The data is parsed in chunks by the C parser of pandas. Only the
+        requested columns are converted, so the memory needed does not depend
+        on the number of columns in the file. The values are parsed exactly,
+        like by np.loadtxt.
+
+        Args:
+            usecols (tuple): Indices of the columns which will be read.
+            chunk_size (int): Number of lines parsed at once.
+
+        Returns:
+            data (np-array): One column for each requested column.
+        """
+
+        reader = pandas.read_csv(
+            self.m_file,
+            sep="\t",
+            header=None,
+            skiprows=self.skiprows,
+            usecols=usecols,
+            dtype={col: np.float64 for col in usecols},
+            encoding=self.encoding,
+            chunksize=chunk_size,
+            engine="c",
+            float_precision="round_trip",
+        )
+        chunks = [chunk[list(usecols)].values for chunk in reader]
+        if not chunks:
+            return np.empty((0, len(usecols)))
+
+        return np.concatenate(chunks)
@@ -34,6 +34,13 @@ def m_id(m_file):
 class Data(object):
     """Represents any data. As optional arguments surface, remarks etc. is useful!"""
 
+    # Attributes which cannot be pickled, e.g. file handles
+    volatile = ("f",)
+    # Attributes with the paths of exported files
+    exports = ()
+    # Attributes with measurement data, not needed after the report is written
+    heavy = ("data",)
+
     def __init__(self, m_file, **kwargs):
         self.remark = "nan"
         self.m_file = m_file
@@ -43,12 +50,60 @@ class Data(object):
             os.path.getmtime(self.m_file)
         ).strftime("%Y-%m-%d %H:%M:%S")
         self.meta = {}
+        self.update_meta(**kwargs)
+
+    def __str__(self):
+        return self.m_id
+
+    def __getstate__(self):
+        """Returns the picklable state, needed to pass items between processes."""
+
+        return {k: v for k, v in self.__dict__.items() if k not in self.volatile}
+
+    def update_meta(self, **kwargs):
+        """Sets the optional arguments, e.g. from the labjournal, as attributes."""
+
         for key, value in kwargs.iteritems():
             setattr(self, key, value)
             self.meta[key] = value
 
-    def __str__(self):
-        return self.m_id
+    def release(self):
+        """Frees the measurement data, the meta data is kept."""
+
+        for attr in self.heavy:
+            if attr in self.__dict__:
+                setattr(self, attr, None)
+
+    def exported_files(self):
+        """Returns the paths of the exported files."""
+
+        return [getattr(self, x) for x in self.exports if getattr(self, x, None)]
+
+    def relocate(self, dirs):
+        """Points the paths of the exported files to their current location.
+
+        The exported files are moved after the processing, see cleanup.
+
+        Args:
+            dirs (list): Directories where the exported files are searched.
+
+        Returns:
+            bool: True if all exported files were found, False otherwise.
+        """
+
+        for attr in self.exports:
+            path = getattr(self, attr, None)
+            if path is None or os.path.isfile(path):
+                continue
+
+            for d in dirs:
+                if os.path.isfile(os.path.join(d, os.path.basename(path))):
+                    setattr(self, attr, os.path.join(d, os.path.basename(path)))
+                    break
+            else:
+                return False
+
+        return True
 
     def return_path(self):
         """Return path to data file."""
@@ -9,17 +9,179 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 import os
 import re
 import pandas
-import codecs
 import numpy as np
 from pint import UnitRegistry
 import config
 import util
+from biologic import MptFile
 from data import Data
 
 
 ureg = UnitRegistry()
 
 
+class Trace(object):
+    """Channels of an electrochemical measurement in contiguous arrays.
+
+    The values of each channel are stored in one row of a 2D array, the
+    cycles are consecutive slices of the rows. A cycle is returned as view,
+    so it is not copied. Dataframes are only created for the export.
+
+    Args:
+        channels (list): Names of the channels, e.g. ['Ecell', 'Icell'].
+        values (np-array): One row (or list entry) of values per channel.
+        units (list): Unit of each channel, e.g. 'V'.
+        cycles (list): Names of the cycles, default: one cycle 'Cycle 1'.
+        bounds (list): Start index of each cycle and the end of the last one.
+        dtype (np-dtype): float64 or float32, which halves the memory.
+    """
+
+    def __init__(
+        self, channels, values, units=None, cycles=None, bounds=None, dtype=np.float64
+    ):
+        self.channels = list(channels)
+        self.values = np.asarray(values, dtype=dtype).reshape(len(self.channels), -1)
+        if self.values.strides[1] != self.values.itemsize:
+            # E.g. the columns of a file, the cycles of a trace are not copied
+            self.values = np.ascontiguousarray(self.values)
+        self.units = [""] * len(self.channels) if units is None else list(units)
+        self.cycles = ["Cycle 1"] if cycles is None else list(cycles)
+        self.bounds = [0, len(self)] if bounds is None else list(bounds)
+
+    @classmethod
+    def from_cycles(cls, channels, values, numbers, sweeps, units=None):
+        """Returns a trace of data points with a cycle number each.
+
+        The data points are sorted by cycle once (stable, so the time order
+        within a cycle is kept). Data points of cycle 0 are dropped.
+
+        Args:
+            channels (list): Names of the channels.
+            values (np-array): One row of values per channel.
+            numbers (np-array): Cycle number (int) of all data points.
+            sweeps (int): Number of cycles.
+            units (list): Unit of each channel.
+        """
+
+        order = np.argsort(numbers, kind="mergesort")
+        counts = np.bincount(numbers, minlength=sweeps + 1)[: sweeps + 1]
+        bounds = np.cumsum(counts) - counts[0]
+        keep = order[counts[0] : bounds[-1] + counts[0]]
+
+        return cls(
+            channels,
+            np.asarray(values)[:, keep],
+            units,
+            ["Cycle " + str(cycle) for cycle in range(1, sweeps + 1)],
+            bounds.tolist(),
+        )
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def __getitem__(self, channel):
+        """Returns the values of a channel of all cycles."""
+
+        return self.values[self.channels.index(channel)]
+
+    def cycle(self, name):
+        """Returns a cycle as trace, which shares the values with this one."""
+
+        i = self.cycles.index(name)
+        start, stop = self.bounds[i], self.bounds[i + 1]
+
+        return Trace(
+            self.channels,
+            self.values[:, start:stop],
+            self.units,
+            [name],
+            [0, stop - start],
+            self.values.dtype,
+        )
+
+    def add(self, channel, values, unit=""):
+        """Adds a channel with one value per data point, e.g. a current density."""
+
+        self.values = np.vstack([self.values, values])
+        self.channels.append(channel)
+        self.units.append(unit)
+
+    def append(self, other, name):
+        """Adds the data points of another trace with the same channels as cycle.
+
+        Args:
+            other (Trace): Data points which will be appended.
+            name (str): Name of the new cycle.
+        """
+
+        self.values = np.hstack([self.values, other.values])
+        self.cycles.append(name)
+        self.bounds.append(len(self))
+
+    def column(self, fmt, cycle, channel):
+        """Returns the name of a column of the dataframe, see frame."""
+
+        unit = self.units[self.channels.index(channel)]
+        return fmt.format(cycle=cycle, channel=channel, unit=unit)
+
+    def frame(self, fmt="{channel}"):
+        """Returns the channels of all cycles side by side as dataframe.
+
+        Shorter cycles are padded with NaN.
+
+        Args:
+            fmt (str): Column name, e.g. '{cycle}: {channel}' or '{channel} [{unit}]'.
+
+        Returns:
+            frame (pandas-df): One column for each channel of each cycle.
+        """
+
+        rows = max(np.diff(self.bounds).tolist() + [0])
+        block = np.full((rows, len(self.cycles) * len(self.channels)), np.nan)
+        columns = []
+        for i, cycle in enumerate(self.cycles):
+            start, stop = self.bounds[i], self.bounds[i + 1]
+            first = i * len(self.channels)
+            block[: stop - start, first : first + len(self.channels)] = self.values[
+                :, start:stop
+            ].T
+            columns.extend(self.column(fmt, cycle, x) for x in self.channels)
+
+        return pandas.DataFrame(block, columns=columns)
+
+
+def decimate(y, n_points):
+    """Returns the indices of the points kept when a trace is reduced for plotting.
+
+    The trace is divided into buckets of consecutive points and the minimum
+    and the maximum of each bucket are kept, so peaks are preserved. NaN
+    values are dropped.
+
+    Args:
+        y (np-array): Values of the trace.
+        n_points (int): Maximum number of points, 0 keeps all points.
+
+    Returns:
+        index (np-array): Sorted indices of the kept points.
+    """
+
+    valid = np.flatnonzero(~np.isnan(y))
+    if not n_points or len(valid) <= n_points:
+        return valid
+
+    size = -(-len(valid) // max(n_points // 2, 1))
+    buckets = -(-len(valid) // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[: len(valid)] = y[valid]
+    padded = padded.reshape(buckets, size)
+    offset = np.arange(buckets) * size
+    keep = np.union1d(
+        offset + np.nanargmin(padded, axis=1), offset + np.nanargmax(padded, axis=1)
+    )
+
+    return valid[keep]
+
+
 class Ec(Data):
     """Represents any electrochemical conditions.
 
@@ -29,6 +191,11 @@ class Ec(Data):
     the html report.
     """
 
+    exports = ("ec_data_file",)
+    heavy = Data.heavy + ("lines", "trace")
+    # Column names of the exported data file, see Trace.frame
+    column_format = "{channel}"
+
     def __init__(self, m_file, **kwargs):
         self.electrolyte = None
         self.gas = None
@@ -39,25 +206,52 @@ class Ec(Data):
         self.we = None
         self.ecell = None
         self.icell = None
+        self.trace = None
         Data.__init__(self, m_file, **kwargs)
 
     def data_points(self):
         """Returns the number of data points"""
 
-        return len(self.ecell)
+        return len(self.trace)
 
     def i_cell_correction(self, cor):
-        """Corrects the cell current by a division factor.
+        """Adds the cell current divided by a factor as channel 'Jcell'.
 
         Args:
             cor (int): Value current will be divided by.
         """
 
-        self.jcell = self.icell.div(cor)
-        self.cvdata = pandas.concat([self.cvdata, self.jcell], axis=1)
+        self.trace.add("Jcell", self.trace["Icell"] / cor)
+
+    def reduce(self, x, y):
+        """Returns two channels of all cycles reduced to config.max_plot_points.
+
+        The points are divided between the cycles, at least the minimum and
+        the maximum of each cycle are kept.
+
+        Args:
+            x (str): Name of the x channel.
+            y (str): Name of the y channel, its extrema are preserved.
+
+        Returns:
+            columns (dict): Reduced values as pandas series by column name.
+        """
+
+        n_points = config.max_plot_points
+        if n_points:
+            n_points = max(n_points // len(self.trace.cycles), 2)
+        columns = {}
+        for name in self.trace.cycles:
+            cycle = self.trace.cycle(name)
+            index = decimate(cycle[y], n_points)
+            for channel in [x, y]:
+                column = cycle.column(self.column_format, name, channel)
+                columns[column] = pandas.Series(cycle[channel][index])
+
+        return columns
 
     def save_ec(self, path):
-        """Saves electrochemical pandas dataframe to ASCII file.
+        """Saves electrochemical data to ASCII file.
 
         Args:
             path (str): Path where the file will be saved.
@@ -66,12 +260,14 @@ class Ec(Data):
         self.ec_data_file = os.path.join(
             path, str(self.m_id) + "_ec." + config.dat_type_out
         )
-        self.cvdata.to_csv(self.ec_data_file, index=False)
+        self.trace.frame(self.column_format).to_csv(self.ec_data_file, index=False)
 
 
 class Cv(Ec):
     """Represents a cyclic voltammogram measurement."""
 
+    column_format = "{cycle}: {channel}"
+
     def __init__(self, m_file, **kwargs):
         Ec.__init__(self, m_file, **kwargs)
         self.pop_next_file = 0
@@ -80,19 +276,17 @@ class Cv(Ec):
         self.v1 = None
         self.v2 = None
         self.sweeps = 1
-        self.ecell = pandas.DataFrame()
-        self.icell = pandas.DataFrame()
-        self.cvdata = pandas.DataFrame()
+        self.trace = Trace(["Ecell", "Icell"], np.empty((2, 0)), ["V", "A"])
         self.import_file(m_file)
 
-    def append_cycle(self, data, id_new, remark):
+    def append_cycle(self, trace, id_new, remark):
         """Adds cv data as following sweeps to this CV class.
 
         This is needed as some measurement programms export for each CV
         cycle a new file.
 
         Args:
-            data (numpy-df): Ecell and Icell data which will be appended.
+            trace (Trace): Ecell and Icell data which will be appended.
             id_new (str): id of file which will be added.
             remark (str): Remark which will be added.
         """
@@ -101,10 +295,12 @@ class Cv(Ec):
         self.remark = self.remark + "; " + remark
         self.sweeps = int(re.search(r"\d\_(.*\d)$", id_new).group(1).strip(" "))
         self.cycle = "Cycle " + str(self.sweeps)
-        self.ecell_new = pandas.DataFrame({self.cycle + ": Ecell": data[:, 1].tolist()})
-        self.cvdata = pandas.concat([self.cvdata, self.ecell_new], axis=1)
-        self.icell_new = pandas.DataFrame({self.cycle + ": Icell": data[:, 2].tolist()})
-        self.cvdata = pandas.concat([self.cvdata, self.icell_new], axis=1)
+        self.trace.append(trace, self.cycle)
+
+    def plot_data(self):
+        """Returns the cycles reduced for plotting, see Ec.reduce."""
+
+        return pandas.DataFrame(self.reduce("Ecell", "Icell"))
 
     def import_ec4(self, m_file):
         """Imports Nordic Electrochemistry EC4 file format.
@@ -124,11 +320,8 @@ class Cv(Ec):
         for x in ext:
             setattr(self, x[0], ureg(x[1].replace(",", ".")))
 
-        self.data = np.loadtxt(m_file, usecols=(0, 1, 2), skiprows=96)
-        self.ecell = pandas.DataFrame({"Cycle 1: Ecell": self.data[:, 1].tolist()})
-        self.cvdata = pandas.concat([self.cvdata, self.ecell], axis=1)
-        self.icell = pandas.DataFrame({"Cycle 1: Icell": self.data[:, 2].tolist()})
-        self.cvdata = pandas.concat([self.cvdata, self.icell], axis=1)
+        data = np.loadtxt(m_file, usecols=(1, 2), skiprows=96, unpack=True)
+        self.trace = Trace(["Ecell", "Icell"], data, ["V", "A"])
 
     def import_labview(self, m_file):
         """Specific function to import Labview txt data.
@@ -137,24 +330,19 @@ class Cv(Ec):
             file (str): Path to file which will be imported.
         """
 
-        self.data = np.loadtxt(m_file, usecols=(0, 1, 2), skiprows=22)
-        self.ecell_list = self.data[:, 1].tolist()
-        self.icell_list = self.data[:, 2].tolist()
-        self.vs = self.ecell_list[0] * ureg("volt")
-        if self.ecell_list[0] < self.ecell_list[1]:  # scan direction vs < v1
-            self.v1 = max(self.ecell_list) * ureg("volt")
-            self.v2 = min(self.ecell_list) * ureg("volt")
+        data = np.loadtxt(m_file, usecols=(0, 1, 2), skiprows=22, unpack=True)
+        self.trace = Trace(["Ecell", "Icell"], data[1:], ["V", "A"])
+        ecell = self.trace["Ecell"]
+        self.vs = ecell[0] * ureg("volt")
+        if ecell[0] < ecell[1]:  # scan direction vs < v1
+            self.v1 = ecell.max() * ureg("volt")
+            self.v2 = ecell.min() * ureg("volt")
         else:  # scan direction vs > v1
-            self.v1 = min(self.ecell_list) * ureg("volt")
-            self.v2 = max(self.ecell_list) * ureg("volt")
-        self.total_time = self.data[len(self.ecell) - 1, 0] * ureg("seconds")
+            self.v1 = ecell.min() * ureg("volt")
+            self.v2 = ecell.max() * ureg("volt")
+        self.total_time = data[0, -1] * ureg("seconds")
         self.rate = 2 * (abs(self.v1) + abs(self.v2)) / self.total_time
 
-        self.ecell = pandas.DataFrame({"Cycle 1: Ecell": self.ecell_list})
-        self.cvdata = pandas.concat([self.cvdata, self.ecell], axis=1)
-        self.icell = pandas.DataFrame({"Cycle 1: Icell": self.icell_list})
-        self.cvdata = pandas.concat([self.cvdata, self.icell], axis=1)
-
     def import_biologic(self, m_file):
         """Function to import mpt-CV files from Biologic potentiostats.
 
@@ -162,52 +350,28 @@ class Cv(Ec):
             file (str): Path to file which will be imported.
         """
 
-        self.lines = util.read_lines(m_file, range(53))
-        if "Cyclic Voltammetry" in self.lines[3]:
+        mpt = MptFile(m_file)
+        if "Cyclic Voltammetry" in mpt.technique():
             self.extract_par = [
                 [r"vs", r"Ei", r"Ei\s\(V\)\s*(\S*)"],
                 [r"v1", r"E1", r"E1\s\(V\)\s*(\S*)"],
                 [r"v2", r"E2", r"E2\s\(V\)\s*(\S*)"],
                 [r"rate", r"dE/dt  ", r"dt\s*(\S*)"],
                 [r"sweeps", r"nc cycles", r"cycles\s*(\S*)"],
-                [r"skiprows", r"Nb header lines", r"lines\s:\s*(\d*)\s*"],
             ]
 
-            ext = util.extract_value(self.extract_par, self.lines.values())
+            ext = util.extract_value(self.extract_par, mpt.header)
             for x in ext:
                 setattr(self, x[0], ureg(x[1]))
 
-            self.file_trimmed = codecs.open(m_file, encoding="cp1252")
-            self.data = np.loadtxt(
-                self.file_trimmed,
-                usecols=(7, 8, 9),
-                skiprows=int(self.skiprows),
-                delimiter="\t",
-            )
+            data = mpt.read_columns((7, 8, 9)).T
+            cycles = data[2].astype(int)
 
             # Biologic files contain all sweeps of a CV in one file
-            self.sweeps = int(max(self.data[:, 2]))
-            for cycle in range(1, self.sweeps + 1):
-                self.ecell = pandas.DataFrame(
-                    {
-                        "Cycle "
-                        + str(cycle)
-                        + ": Ecell": self.data[
-                            np.where(self.data[:, 2] == cycle), 0
-                        ].tolist()[0]
-                    }
-                )
-                self.cvdata = pandas.concat([self.cvdata, self.ecell], axis=1)
-                self.icell = pandas.DataFrame(
-                    {
-                        "Cycle "
-                        + str(cycle)
-                        + ": Icell": self.data[
-                            np.where(self.data[:, 2] == cycle), 1
-                        ].tolist()[0]
-                    }
-                )
-                self.cvdata = pandas.concat([self.cvdata, self.icell], axis=1)
+            self.sweeps = int(cycles.max()) if len(cycles) else 0
+            self.trace = Trace.from_cycles(
+                ["Ecell", "Icell"], data[:2], cycles, self.sweeps, ["V", "A"]
+            )
 
     def import_file(self, m_file):
         """Function which decides which import function to use.
@@ -237,9 +401,7 @@ class Peis(Ec):
         Ec.__init__(self, m_file, **kwargs)
         self.fi = None
         self.ff = None
-        self.imgr = pandas.DataFrame()
-        self.rer = pandas.DataFrame()
-        self.peisdata = pandas.DataFrame()
+        self.trace = Trace(["re R", "img R"], np.empty((2, 0)), ["Ohm", "Ohm"])
         self.import_biologic(m_file)
 
     def import_biologic(self, m_file):
@@ -249,8 +411,8 @@ class Peis(Ec):
             file (str): Path to file which will be imported.
         """
 
-        self.lines = util.read_lines(m_file, range(83))
-        if "Potentio Electrochemical Impedance Spectroscopy" in self.lines[3]:
+        mpt = MptFile(m_file)
+        if "Potentio Electrochemical Impedance Spectroscopy" in mpt.technique():
             self.extract_par = [
                 [r"ecell", r"E (V)", r"E\s\(V\)\s*(\S*)"],
                 [r"fi", r"fi                  ", r"^fi\s*(\S*)"],
@@ -258,34 +420,29 @@ class Peis(Ec):
                 [r"ff", r"ff                  ", r"^ff\s*(\S*)"],
                 [r"ff_unit", r"unit ff", r"\sff\s*(\S*)"],
                 [r"amplitude", r"Va", r"\(mV\)\s*(\S*)"],
-                [r"skiprows", r"Nb header lines", r"lines\s:\s*(\d*)\s*"],
             ]
 
-            ext = util.extract_value(self.extract_par, self.lines.values())
+            ext = util.extract_value(self.extract_par, mpt.header)
             for x in ext:
                 setattr(self, x[0], str(x[1]))
 
-            self.file_trimmed = codecs.open(m_file, encoding="cp1252")
-            self.data = np.loadtxt(
-                self.file_trimmed,
-                usecols=(0, 1, 2),
-                skiprows=int(self.skiprows),
-                delimiter="\t",
-            )
-            self.rer = pandas.DataFrame({"re R": self.data[:, 1].tolist()})
-            self.imgr = pandas.DataFrame({"img R": self.data[:, 2].tolist()})
-            self.peisdata = pandas.concat([self.peisdata, self.rer], axis=1)
-            self.peisdata = pandas.concat([self.peisdata, self.imgr], axis=1)
+            data = mpt.read_columns((1, 2))
+            self.trace = Trace(["re R", "img R"], data.T, ["Ohm", "Ohm"])
+
+    def plot_data(self):
+        """Returns the impedance data reduced for plotting, see Ec.reduce."""
+
+        return pandas.DataFrame(self.reduce("re R", "img R"))
 
 
 class Chrono(Ec):
     """Chronoamperometry measurement."""
 
+    column_format = "{channel} [{unit}]"
+
     def __init__(self, m_file, **kwargs):
         Ec.__init__(self, m_file, **kwargs)
-        self.time = pandas.DataFrame()
-        self.icell = pandas.DataFrame()
-        self.chronodata = pandas.DataFrame()
+        self.trace = Trace(["time", "Icell"], np.empty((2, 0)), ["s", "mA"])
         self.import_biologic(m_file)
 
     def import_biologic(self, m_file):
@@ -295,25 +452,20 @@ class Chrono(Ec):
             file (str): Path to file which will be imported.
         """
 
-        self.lines = util.read_lines(m_file, range(57))
-        if "Chrono" in self.lines[3]:
+        mpt = MptFile(m_file)
+        if "Chrono" in mpt.technique():
             self.extract_par = [
                 [r"ecell", r"Ei", r"Ei\s\(V\)\s*(\S*)"],
-                [r"skiprows", r"Nb header lines", r"lines\s:\s*(\d*)\s*"],
             ]
 
-            ext = util.extract_value(self.extract_par, self.lines.values())
+            ext = util.extract_value(self.extract_par, mpt.header)
             for x in ext:
                 setattr(self, x[0], str(x[1]))
 
-            self.file_trimmed = codecs.open(m_file, encoding="cp1252")
-            self.data = np.loadtxt(
-                self.file_trimmed,
-                usecols=(7, 10),
-                skiprows=int(self.skiprows),
-                delimiter="\t",
-            )
-            self.time = pandas.DataFrame({"time [s]": self.data[:, 0].tolist()})
-            self.icell = pandas.DataFrame({"Icell [mA]": self.data[:, 1].tolist()})
-            self.chronodata = pandas.concat([self.chronodata, self.time], axis=1)
-            self.chronodata = pandas.concat([self.chronodata, self.icell], axis=1)
+            data = mpt.read_columns((7, 10))
+            self.trace = Trace(["time", "Icell"], data.T, ["s", "mA"])
+
+    def plot_data(self):
+        """Returns the current transient reduced for plotting, see Ec.reduce."""
+
+        return pandas.DataFrame(self.reduce("time", "Icell"))
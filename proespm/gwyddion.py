@@ -9,8 +9,10 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 import os
 import time
 from datetime import datetime
+import numpy as np
 import config
 import data
+import render
 from util import import_helper, win32_helper
 
 import_helper()
@@ -20,6 +22,7 @@ if "path_gwyddion" not in locals():
 
 # pylint: disable=wrong-import-position
 import gwy
+import gwyutils
 
 # pylint: enable=wrong-import-position
 
@@ -30,19 +33,153 @@ def get_meta_ids(container):
     return [i for i in container.keys() if "Container" in type(container[i]).__name__]
 
 
-def save_image_file(container, save_file):
+class FieldBuffer(object):
+    """Exposes the memory of a Gwyddion data field to NumPy.
+
+    The object keeps a reference to the data field, so the memory stays
+    valid as long as an array created from it exists.
+
+    Args:
+        field (gwy.DataField): Data field.
+        address (int): Address of the first value of the field.
+        readonly (bool): False: changes of the array change the field.
+    """
+
+    def __init__(self, field, address, readonly=True):
+        self.field = field
+        self.__array_interface__ = {
+            "shape": field_shape(field),
+            "typestr": np.dtype(np.float64).str,
+            "data": (address, readonly),
+            "version": 3,
+        }
+
+
+def field_shape(field):
+    """Returns the shape (rows, columns) of a data field.
+
+    Only the metadata of the field is read, not the pixel data.
+
+    Args:
+        field (gwy.DataField): Data field.
+    """
+
+    return field.get_yres(), field.get_xres()
+
+
+def field_array(field):
+    """Returns the values of a data field as a read-only NumPy array.
+
+    The array is a view of the memory of the data field, no data is copied.
+    If the Gwyddion bindings do not provide the address of the data, a copy
+    is returned instead.
+
+    Args:
+        field (gwy.DataField): Data field.
+
+    Returns:
+        np_array (array): Array with the shape (rows, columns).
+    """
+
+    get_pointer = getattr(field, "get_data_pointer", None)
+    if get_pointer is None:
+        return gwyutils.data_field_data_as_array(field)
+
+    return np.asarray(FieldBuffer(field, int(get_pointer())))
+
+
+def set_field_data(field, values):
+    """Replaces the values of a data field.
+
+    If the Gwyddion bindings do not provide the address of the data, the
+    values are set by gwyutils, see field_array.
+
+    Args:
+        field (gwy.DataField): Data field.
+        values (np-array): New values with the shape (rows, columns).
+    """
+
+    get_pointer = getattr(field, "get_data_pointer", None)
+    if get_pointer is None:
+        gwyutils.data_field_set_data(field, np.ascontiguousarray(values, np.float64))
+    else:
+        np.asarray(FieldBuffer(field, int(get_pointer()), readonly=False))[:] = values
+    field.data_changed()
+
+
+def field_mask(container, channel_id):
+    """Returns the mask of a channel as bool array, None if there is no mask.
+
+    Args:
+        container (gwy-container): Gwyddion container.
+        channel_id (int): ID of the channel.
+    """
+
+    name = "/" + str(channel_id) + "/mask"
+    if not container.contains_by_name(name):
+        return None
+
+    return field_array(container[name]) > 0
+
+
+def color_settings(container, channel_id):
+    """Returns the color range type, gradient and fixed range of a channel.
+
+    Args:
+        container (gwy-container): Gwyddion container.
+        channel_id (int): ID of the channel.
+    """
+
+    base = "/" + str(channel_id) + "/base/"
+    settings = {"range-type": render.range_full, "palette": "gray"}
+    for k in ["range-type", "palette", "min", "max"]:
+        if container.contains_by_name(base + k):
+            settings[k] = container[base + k]
+    fixed = None  # full range, unless both limits are set
+    if "min" in settings and "max" in settings:
+        fixed = (settings["min"], settings["max"])
+
+    return settings["range-type"], settings["palette"], fixed
+
+
+def save_image_file(container, save_file, channel_id=None):
     """Saves image file through Gwyddion, with optional file dialog.
 
+    PNG files are rendered with NumPy if configured and no dialog is shown.
+    If the channel is given, a thumbnail and optionally a tile pyramid are
+    saved next to the image, see render.py.
+
     Args:
         container (gwy-container): Gwyddion container which will be exported.
         save_file (str): Filepath how the file will be saved.
+        channel_id (int): Channel which is exported, the current channel of
+                          the data browser.
     """
 
-    if config.export_image_dialog:
+    if channel_id is None:
+        is_native = False
+    else:
+        is_native = (
+            config.img_renderer == "numpy"
+            and not config.export_image_dialog
+            and save_file.lower().endswith(".png")
+        )
+        z_data = field_array(container["/" + str(channel_id) + "/data"])
+        range_type, gradient, fixed = color_settings(container, channel_id)
+        scale = render.color_scale(z_data, range_type, fixed)
+
+    if is_native:
+        render.save_png(z_data, save_file, gradient=gradient, scale=scale)
+    elif config.export_image_dialog:
         gwy.gwy_file_save(container, save_file, gwy.RUN_INTERACTIVE)
     else:
         gwy.gwy_file_save(container, save_file, gwy.RUN_NONINTERACTIVE)
 
+    if channel_id is not None and config.thumbnail_size:
+        render.save_thumbnail(z_data, save_file, config.thumbnail_size, gradient, scale)
+    if channel_id is not None and config.is_tile_pyramid:
+        render.save_tiles(z_data, save_file, gradient, scale)
+
 
 def mul_split(file_path):
     """Splits all data channels into single gwy files"""
@@ -8,8 +8,35 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 
 import os
 import re
+import base64
+import heapq
+import hashlib
+import shutil
+import itertools
+import numpy as np
 import config
+import render
+import timing
 from genshi.template import TemplateLoader
+from bokeh.plotting import figure
+from bokeh.document import Document
+from bokeh.embed import components
+from bokeh.palettes import Spectral11
+from bokeh.models import ColumnDataSource
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+
+# Shared by all pages of the report, instead of being embedded in each page
+bokeh_js = "1.4.0_bokeh.min.js"
+
+# Fingerprints of the written pages by path in the source directory, None:
+# pages are always written. The watch mode sets a dict, so pages without new
+# items are kept.
+written_pages = None
 
 
 def create_html_head(src_dir):
@@ -65,24 +92,549 @@ def create_html_head(src_dir):
     return head
 
 
-def create_html(src_dir, proc_dir, list_classes):
+def encode_thumbnail(img_file):
+    """Returns the thumbnail of an image as data URI.
+
+    If there is no thumbnail, the image itself is embedded.
+
+    Args:
+        img_file (str): Path to the image file.
+    """
+
+    thumb = render.thumb_file(img_file)
+    if not os.path.isfile(thumb):
+        thumb = img_file
+    with open(thumb, "rb") as f:
+        return "data:image/png;base64, " + base64.b64encode(f.read()).decode("ascii")
+
+
+def image_link(src_dir, img_file):
+    """Returns the link to an exported image relative to the HTML report.
+
+    The link points to the location of the image after the cleanup.
+
+    Args:
+        src_dir (str): Source directory where all raw files are stored.
+        img_file (str): Path to the image file.
+    """
+
+    link = quote(os.path.basename(img_file))
+    if config.hierarchy:
+        link = quote(os.path.basename(os.path.normpath(src_dir))) + "/_png/" + link
+
+    return link
+
+
+def column_source(columns):
+    """Returns a data source with the columns as float64 arrays.
+
+    Bokeh serializes NumPy float arrays as base64 encoded binary data,
+    which is smaller and faster to parse than lists of numbers.
+
+    Args:
+        columns (dict or pandas-df): Data by column name.
+    """
+
+    return ColumnDataSource(
+        {str(k): np.asarray(columns[k], dtype=np.float64) for k in columns}
+    )
+
+
+def new_figure(**kwargs):
+    """Returns a Bokeh figure with the toolbar settings of the report.
+
+    Args:
+        **kwargs: Arguments of the figure, e.g. axis labels.
+    """
+
+    plot = figure(
+        sizing_mode="scale_width",
+        tools="pan, wheel_zoom, box_zoom, crosshair, save, reset",
+        **kwargs
+    )
+    plot.toolbar.active_drag = "auto"
+    plot.toolbar.active_scroll = "auto"
+    plot.toolbar.active_inspect = None
+    plot.toolbar.logo = None
+    plot.background_fill_alpha = 0
+
+    return plot
+
+
+def plot_ecstm(item):
+    """Returns the plots of the cell potential and the cell current of an ECSTM item."""
+
+    plot_data = item.plot_data()
+    plot_ec = new_figure(
+        plot_width=390,
+        plot_height=390,
+        x_axis_label="ECSTM line",
+        y_axis_label="U [V vs " + str(item.re) + "]",
+    )
+    sources = {}
+    for name, (x, y) in plot_data.items():
+        sources[name] = column_source({"x": x, "y": y})
+    plot_ec.circle(source=sources["ecell"], x="x", y="y", size=2, legend_label="Ecell")
+    plot_ec.circle(
+        source=sources["utun"], x="x", y="y", color="olive", size=2, legend_label="Utun"
+    )
+
+    y_axis = "I [uA/cm2]" if hasattr(item, "jcell") else "I [uA]"
+    plot_ic = new_figure(
+        plot_width=390, plot_height=390, x_axis_label="ECSTM line", y_axis_label=y_axis
+    )
+    plot_ic.circle(source=sources["icell"], x="x", y="y", size=2)
+
+    return {"ec": plot_ec, "ic": plot_ic}
+
+
+def plot_cv(item):
+    """Returns the plot of all cycles of a CV item."""
+
+    plot = new_figure(
+        plot_width=1000,
+        plot_height=540,
+        x_axis_label="U [V vs " + str(item.re) + "]",
+        y_axis_label="I [A]",
+    )
+    source = column_source(item.plot_data())
+    for cycle in range(1, int(item.sweeps) + 1):
+        plot.circle(
+            source=source,
+            x="Cycle " + str(cycle) + ": Ecell",
+            y="Cycle " + str(cycle) + ": Icell",
+            size=3,
+            color=Spectral11[cycle],
+            legend_label="Cycle " + str(cycle),
+        )
+    plot.legend.location = "bottom_right"
+
+    return {"cv": plot}
+
+
+def plot_peis(item):
+    """Returns the Nyquist plot of a PEIS item."""
+
+    plot = new_figure(
+        plot_width=1000,
+        plot_height=540,
+        x_axis_label="real R [Ohm]",
+        y_axis_label="imag. R [Ohm]",
+    )
+    source = column_source(item.plot_data())
+    plot.circle(source=source, x="re R", y="img R", size=4, color=Spectral11[1])
+
+    return {"peis": plot}
+
+
+def plot_chrono(item):
+    """Returns the plot of the current transient of a chronoamperometry item."""
+
+    plot = new_figure(plot_width=1000, plot_height=540)
+    source = column_source(item.plot_data())
+    plot.circle(
+        source=source, x="time [s]", y="Icell [mA]", size=4, color=Spectral11[1]
+    )
+
+    return {"chrono": plot}
+
+
+def plot_raman(item):
+    """Returns the plot of a Raman spectrum."""
+
+    plot = new_figure(
+        plot_width=1000,
+        plot_height=540,
+        x_axis_label="Wavenumbers / cm-1",
+        y_axis_label="Intensity / ab. units",
+    )
+    source = column_source({"x": item.wavelength, "y": item.intensity})
+    plot.circle(source=source, x="x", y="y", size=2)
+
+    return {"raman": plot}
+
+
+def plot_xps(item):
+    """Returns the plot of an XPS spectrum."""
+
+    plot = new_figure(
+        plot_width=1000,
+        plot_height=540,
+        x_axis_label="Ekin / eV",
+        y_axis_label="Intensity / ab. units",
+    )
+    source = column_source({"x": item.e_kin, "y": item.intensity})
+    plot.circle(source=source, x="x", y="y", size=2)
+
+    return {"xps": plot}
+
+
+plot_functions = {
+    "Ecstm": plot_ecstm,
+    "Cv": plot_cv,
+    "Peis": plot_peis,
+    "Chrono": plot_chrono,
+    "Raman": plot_raman,
+    "Xps": plot_xps,
+}
+
+# Images shown in the report, by item class
+image_attrs = {
+    "Stm": ["img_topo_fwd", "img_topo_bwd"],
+    "Ecstm": ["img_topo_fwd", "img_topo_bwd"],
+    "Afm": ["img_topo_fwd", "img_topo_bwd", "img_phase_fwd", "img_phase_bwd"],
+    "Sem": ["img"],
+    "Image": ["m_file"],
+}
+
+
+def full_images(src_dir, item):
+    """Returns the links of the full images of an item, shown in the modal view.
+
+    Args:
+        src_dir (str): Source directory where all raw files are stored.
+        item (Data): Measurement item.
+
+    Returns:
+        links (dict): Links by image, 'fwd', 'bwd' or 'img'.
+    """
+
+    attrs = {"fwd": "img_topo_fwd", "bwd": "img_topo_bwd", "img": "img"}
+    links = {}
+    for k, attr in attrs.items():
+        img_file = getattr(item, attr, None)
+        if img_file is not None:
+            links[k] = image_link(src_dir, img_file)
+
+    return links
+
+
+def create_view(src_dir, item, slide=0):
+    """Prepares everything the template needs to render an item.
+
+    Args:
+        src_dir (str): Source directory where all raw files are stored.
+        item (Data): Measurement item.
+        slide (int): Slide number in the modal view, 0: no slide.
+
+    Returns:
+        view (dict): The item, its slide number, the embedded thumbnails by
+                     attribute, the links of the full images and the Bokeh
+                     plots, which are replaced by their divs in embed_plots.
+    """
+
+    name = type(item).__name__
+    view = {
+        "item": item,
+        "name": name,
+        "slide": slide,
+        "thumbs": {},
+        "full": {},
+        "plots": {},
+        "divs": {},
+    }
+    if name in image_attrs:
+        view["full"] = full_images(src_dir, item)
+        for attr in image_attrs[name]:
+            if getattr(item, attr, None) is not None:
+                view["thumbs"][attr] = encode_thumbnail(getattr(item, attr))
+    if name in plot_functions:
+        view["plots"] = plot_functions[name](item)
+
+    return view
+
+
+def iter_views(src_dir, list_classes, slides, done=None):
+    """Yields the views of the items, see create_view.
+
+    The measurement data of each item is released once its view exists.
+    The slides of the modal view are collected on the way, they are
+    rendered after all items.
+
+    Args:
+        src_dir (str): Source directory where all raw files are stored.
+        list_classes (iterable): Data classes in the order of the report.
+        slides (list): Slides of the modal view, filled by this generator.
+        done (function): Called with each item once its files are not
+                         needed for the report anymore.
+    """
+
+    for item in list_classes:
+        name = type(item).__name__
+        slide = len(slides) + 1 if name in image_attrs else 0
+        with timing.stage(item, "report"):
+            view = create_view(src_dir, item, slide)
+        if slide:
+            slides.append({"item": item, "name": name, "full": view["full"]})
+        item.release()
+        if done is not None:
+            done(item)
+        yield view
+
+
+def shared_document(plots):
+    """Returns a new Bokeh document with the plots as roots.
+
+    Bokeh updates the list of all models of a document each time a root is
+    added, so the updates are deferred until all plots are added.
+
+    Args:
+        plots (list): Bokeh figures.
+    """
+
+    doc = Document()
+    doc._push_all_models_freeze()  # pylint: disable=protected-access
+    try:
+        for plot in plots:
+            doc.add_root(plot)
+    finally:
+        doc._pop_all_models_freeze()  # pylint: disable=protected-access
+
+    return doc
+
+
+def embed_plots(views, batch, scripts):
+    """Yields the views with the divs of their plots.
+
+    The plots of a batch of views are put into one document and serialized
+    together with a single components call, the script of each batch is
+    added to scripts.
+
+    Args:
+        views (iterable): Views, see create_view.
+        batch (int): Number of views per batch, 0: all views.
+        scripts (list): Bokeh scripts, filled by this generator.
+    """
+
+    views = iter(views)
+    while True:
+        chunk = list(itertools.islice(views, batch) if batch else views)
+        if not chunk:
+            return
+
+        models = []
+        for view in chunk:
+            for key, plot in sorted(view.pop("plots").items()):
+                models.append((view, key, plot))
+        if models:
+            plots = [x[2] for x in models]
+            shared_document(plots)
+            script, divs = components(plots, wrap_script=False)
+            scripts.append(script)
+            for (view, key, _), div in zip(models, divs):
+                view["divs"][key] = div
+
+        for view in chunk:
+            yield view
+
+
+def reorder(list_classes, window):
+    """Yields the items sorted by datetime within a window.
+
+    An item is yielded once window newer items have arrived, so the order
+    is exact as long as no item arrives more than window items late.
+
+    Args:
+        list_classes (iterable): Data classes.
+        window (int): Number of items held back.
+    """
+
+    heap = []
+    for i, item in enumerate(list_classes):
+        heapq.heappush(heap, (item.datetime, i, item))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def paginate(list_classes, split):
+    """Splits the items into the pages of the report.
+
+    The pages are yielded while the items are consumed, each page has to
+    be consumed completely before the next one is requested.
+
+    Args:
+        list_classes (iterable): Data classes, sorted by datetime.
+        split (int or str): Number of items per page or 'day'.
+
+    Yields:
+        key (str): Key of the page, e.g. '003' or '2019-11-27'.
+        items (iterator): Data classes of the page.
+    """
+
+    if split == "day":
+        # The datetime is a string, e.g. '2019-11-27 14:03:12'
+        for day, items in itertools.groupby(list_classes, lambda x: x.datetime[:10]):
+            yield day, items
+        return
+
+    iterator = iter(list_classes)
+    for number in itertools.count(1):
+        try:
+            first = next(iterator)
+        except StopIteration:
+            return
+        yield "{0:03d}".format(number), itertools.chain(
+            [first], itertools.islice(iterator, int(split) - 1)
+        )
+
+
+def count_items(items, page):
+    """Yields the items and records their number and time span in page."""
+
+    for item in items:
+        page["items"] += 1
+        if page["first"] is None:
+            page["first"] = item.datetime
+        page["last"] = item.datetime
+        yield item
+
+
+def fingerprint(items):
+    """Returns a hash of everything of the items which is shown on a page."""
+
+    md5 = hashlib.md5()
+    for item in items:
+        shown = (
+            type(item).__name__,
+            item.m_id,
+            item.datetime,
+            item.remark,
+            sorted(item.meta.items()),
+            [os.path.basename(f) for f in item.exported_files()],
+        )
+        md5.update(repr(shown).encode("utf-8"))
+
+    return md5.hexdigest()
+
+
+def skip_page(list_classes, done=None):
+    """Consumes the items of a page which is not written again."""
+
+    for item in list_classes:
+        item.release()
+        if done is not None:
+            done(item)
+
+
+def write_page(
+    tmpl, proc_dir, file_name, src_dir, list_classes, index=None, batch=0, done=None
+):
+    """Renders the items with the template and writes the HTML file.
+
+    Args:
+        tmpl (Template): Genshi template of the report.
+        proc_dir (str): Directory where files are processed.
+        file_name (str): Name of the HTML file, also used as title.
+        src_dir (str): Source directory where all raw files are stored.
+        list_classes (iterable): Data classes in the order of the report.
+        index (str): File name of the index page, None: no index.
+        batch (int): Number of items whose plots are serialized together,
+                     0: all items of the page.
+        done (function): Called with each item once it is rendered, see
+                         iter_views.
+    """
+
+    slides = []
+    scripts = []
+    stream = tmpl.generate(
+        title=file_name,
+        src_dir=src_dir,
+        bokeh_js=bokeh_js,
+        index=index,
+        views=embed_plots(
+            iter_views(src_dir, list_classes, slides, done), batch, scripts
+        ),
+        slides=slides,
+        scripts=scripts,
+    )
+
+    with open(os.path.join(proc_dir, file_name), "wb") as f:
+        for output in stream.serialize("html"):
+            f.write(output)
+
+
+def create_html(src_dir, proc_dir, list_classes, window=0, split=0, done=None):
     """Creates HTML file by using the template and all processed data.
 
+    The report is written while the items are consumed, so list_classes
+    can be a generator of items which are still being processed. Large
+    reports can be split into several pages, which are listed on an index
+    page with the name of the single report.
+
     Args:
         src_dir (str): Source directory where all raw files are stored.
         proc_dir (str): Directory where files are processed.
-        list_classes (list): List of data classes.
+        list_classes (iterable): Data classes, sorted by datetime if window is 0.
+        window (int): Reorder window, see reorder. 0: keep the given order.
+                      Also the number of items whose plots are serialized
+                      together, 0: all items of a page.
+        split (int or str): Items per page or 'day' for one page per
+                            measurement day. 0: single page.
+        done (function): Called with each item once it is rendered, see
+                         iter_views.
+
+    With written_pages, pages whose items did not change since they were
+    written by this process are not written again.
     """
 
     templates_dir = os.getcwd()
     loader = TemplateLoader(templates_dir, auto_reload=False)
     tmpl = loader.load("template.html")
+    shutil.copy(os.path.join(templates_dir, bokeh_js), proc_dir)
 
-    file_name = os.path.basename(os.path.normpath(src_dir)) + "_report.html"
-    file_path = os.path.join(proc_dir, file_name)
+    report_name = os.path.basename(os.path.normpath(src_dir)) + "_report"
+    if window:
+        list_classes = reorder(list_classes, window)
+    if not split:
+        write_page(
+            tmpl,
+            proc_dir,
+            report_name + ".html",
+            src_dir,
+            list_classes,
+            batch=window,
+            done=done,
+        )
+        return
 
-    stream = tmpl.generate(title=file_name, src_dir=src_dir, list_classes=list_classes)
+    pages = []
+    for key, items in paginate(list_classes, split):
+        # Items which arrive late in the reorder window can start a day again
+        if any(x["key"] == key for x in pages):
+            key += "_" + str(len(pages))
+        page = {
+            "key": key,
+            "file": "{0}_{1}.html".format(report_name, key),
+            "items": 0,
+            "first": None,
+            "last": None,
+        }
+        items = count_items(items, page)
+        page_path = os.path.join(src_dir, page["file"])
+        if written_pages is not None:
+            items = list(items)
+            sign = fingerprint(items)
+            if written_pages.get(page_path) == sign:
+                skip_page(items, done)
+                pages.append(page)
+                continue
+            written_pages[page_path] = sign
+        write_page(
+            tmpl,
+            proc_dir,
+            page["file"],
+            src_dir,
+            items,
+            index=report_name + ".html",
+            batch=window,
+            done=done,
+        )
+        pages.append(page)
 
-    with open(file_path, "wb") as f:
-        for output in stream.serialize("html"):
-            f.write(output)
+    stream = loader.load("template_index.html").generate(
+        title=report_name + ".html", src_dir=src_dir, pages=pages
+    )
+    with open(os.path.join(proc_dir, report_name + ".html"), "wb") as f:
+        f.write(stream.render("html"))
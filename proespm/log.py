@@ -9,14 +9,33 @@ from __future__ import print_function
 import time
 import sys
 import os
+import atexit
+import threading
+import functools
 import config
+from util import progress_bar
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class Logging(object):
-    """Represents one log session."""
+    """Represents one log session.
+
+    The log lines are printed by a background thread, so the amount of
+    logging does not slow down the processing. The progress bar is drawn by
+    the same thread, in the order of the log lines.
+    """
 
     def __init__(self):
         self.logs = []
+        self.queue = queue.Queue()
+        self.printer = threading.Thread(target=self.print_lines)
+        self.printer.daemon = True
+        self.printer.start()
+        atexit.register(self.stop)
         self.log_p(8, "Log started")
 
     def log_p(self, log_priority, text=""):
@@ -34,13 +53,16 @@ class Logging(object):
             if text == "":
                 self.log_line = "\n"
                 self.logs.append(self.log_line)
-                print("")
-                self.flush_delay()
+                self.queue.put("")
             else:
                 self.log_line = "[" + time.strftime("%Y-%M-%d %X") + "]" + ": " + text
                 self.logs.append(self.log_line)
-                print(self.log_line)
-                self.flush_delay()
+                self.queue.put(self.log_line)
+
+    def progress(self, iteration, total, **kwargs):
+        """Draws the progress bar after the log lines so far, see util.progress_bar."""
+
+        self.queue.put(functools.partial(progress_bar, iteration, total, **kwargs))
 
     def save_log(self, log_file_path, log_f_name):
         """Function to write all log informations in a log file.
@@ -50,14 +72,46 @@ class Logging(object):
             log_f_name (str): Information you would like to be logged.
         """
 
+        self.flush()
         with open(os.path.join(log_file_path, log_f_name), "wt") as self.f:
             for self.line in self.logs:
                 self.f.writelines(
                     "[" + time.strftime("%Y-%M-%d %X") + "]" + ": " + self.line + "\n"
                 )
 
-    def flush_delay(self):
-        """Flush the Python terminal buffer."""
+    def clear(self):
+        """Starts a new log file content, e.g. for the next source directory."""
+
+        self.logs = []
+
+    def print_lines(self):
+        """Prints the queued log lines, runs in the background thread."""
 
+        while True:
+            line = self.queue.get()
+            if line is None:
+                self.queue.task_done()
+                return
+            if callable(line):
+                line()
+            else:
+                print(line)
+            if self.queue.empty():
+                sys.stdout.flush()
+            self.queue.task_done()
+
+    def flush(self):
+        """Waits until all log lines are printed."""
+
+        self.queue.join()
         sys.stdout.flush()
-        time.sleep(0.01)
+
+    def stop(self):
+        """Prints the remaining log lines and stops the background thread.
+
+        Called at exit, as Python 2 fails to end a thread which waits.
+        """
+
+        if self.printer.is_alive():
+            self.queue.put(None)
+            self.printer.join()
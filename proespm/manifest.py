@@ -0,0 +1,210 @@
+"""manifest.py
+
+Part of proespm: Run manifest for the incremental processing.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import config
+
+
+manifest_name = "_proespm_manifest.pkl"
+spm_classes = ["Stm", "Ecstm", "Afm"]
+
+
+def file_hash(m_file, block_size=2**20):
+    """Returns the MD5 hash of the file content.
+
+    Args:
+        m_file (str): Path to the file.
+        block_size (int): Number of bytes read at once.
+    """
+
+    md5 = hashlib.md5()
+    with open(m_file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+
+    return md5.hexdigest()
+
+
+def config_hash(cls_name):
+    """Returns the hash of the configuration which affects the output of a class.
+
+    Changes of the SPM processing only affect the SPM classes.
+
+    Args:
+        cls_name (str): Name of the measurement class, e.g. 'Stm'.
+    """
+
+    relevant = {
+        "export": [
+            config.dat_type_out,
+            config.dat_type_igor,
+            config.img_type_out,
+            config.img_renderer,
+            config.thumbnail_size,
+            config.is_tile_pyramid,
+        ]
+    }
+    if cls_name in spm_classes:
+        relevant["spm"] = config.config["spm"]
+
+    return hashlib.md5(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Manifest(object):
+    """Remembers the processed files of one source directory.
+
+    The entries are keyed by the path of the file relative to the source
+    directory. Each entry stores size, mtime and content hash of the file,
+    the configuration hash of the measurement class and the processed item.
+
+    Args:
+        src_dir (str): Source directory, where the manifest is stored.
+    """
+
+    def __init__(self, src_dir):
+        self.src_dir = src_dir
+        self.path = os.path.join(src_dir, manifest_name)
+        self.origin = {}
+        self.hashes = {}
+        self.checked = {}
+        try:
+            with open(self.path, "rb") as f:
+                self.entries = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            self.entries = {}
+
+    def track(self, proc_file, src_file):
+        """Remembers the source file of a copy in the temporary folder.
+
+        Args:
+            proc_file (str): Path to the copied file.
+            src_file (str): Path to the source file.
+        """
+
+        self.origin[proc_file] = src_file
+
+    def key(self, m_file):
+        """Returns the manifest key of a file."""
+
+        src_file = self.origin.get(m_file, m_file)
+        return os.path.relpath(src_file, self.src_dir).replace("\\", "/")
+
+    def signature(self, m_file):
+        """Returns size, mtime and content hash of a file.
+
+        Size and mtime are taken from the source file, as the copy in the
+        temporary folder can have a different mtime resolution.
+        """
+
+        stat = os.stat(self.origin.get(m_file, m_file))
+        if m_file not in self.hashes:
+            self.hashes[m_file] = file_hash(m_file)
+
+        return stat.st_size, stat.st_mtime, self.hashes[m_file]
+
+    def is_unchanged(self, m_file):
+        """Checks if a file has not changed since it was processed.
+
+        The result is remembered, so a file which is being copied to the
+        temporary folder is not hashed again.
+
+        Args:
+            m_file (str): Path to the file.
+
+        Returns:
+            bool: True if the file is unchanged, False otherwise.
+        """
+
+        key = self.key(m_file)
+        if key not in self.checked:
+            self.checked[key] = self.compare(m_file)
+
+        return self.checked[key]
+
+    def refresh(self):
+        """Forgets which files were checked, before the next run of a watch session.
+
+        The content hashes of the source files are kept, as measurement files
+        are not written again. The copies in the temporary folder are gone.
+        """
+
+        self.hashes = {k: v for k, v in self.hashes.items() if k not in self.origin}
+        self.checked = {}
+        self.origin = {}
+
+    def compare(self, m_file):
+        """Compares the signature of a file with its manifest entry."""
+
+        entry = self.entries.get(self.key(m_file))
+        if entry is None:
+            return False
+
+        # Only hash the content if size and mtime match
+        stat = os.stat(self.origin.get(m_file, m_file))
+        if entry["signature"][:2] != (stat.st_size, stat.st_mtime):
+            return False
+
+        return entry["signature"] == self.signature(m_file)
+
+    def lookup(self, m_file, cls_name, dirs):
+        """Returns the item of a file which does not need to be processed again.
+
+        Args:
+            m_file (str): Path to the file.
+            cls_name (str): Name of the measurement class, e.g. 'Stm'.
+            dirs (list): Directories where exported files are searched.
+
+        Returns:
+            item (Data): Processed item or None if the file needs processing.
+        """
+
+        entry = self.entries.get(self.key(m_file))
+        if (
+            entry is None
+            or entry["class"] != cls_name
+            or entry["config"] != config_hash(cls_name)
+            or not self.is_unchanged(m_file)
+        ):
+            return None
+
+        item = pickle.loads(entry["item"])
+        if not item.relocate(dirs):
+            return None
+
+        return item
+
+    def record(self, m_file, item):
+        """Stores a processed item.
+
+        Files outside the source directory, e.g. split mul files in the
+        temporary folder, are not recorded.
+
+        Args:
+            m_file (str): Path to the file.
+            item (Data): Processed item.
+        """
+
+        key = self.key(m_file)
+        if key.startswith(".."):
+            return
+
+        self.entries[key] = {
+            "signature": self.signature(m_file),
+            "class": type(item).__name__,
+            "config": config_hash(type(item).__name__),
+            "item": pickle.dumps(item, 2),
+        }
+
+    def save(self):
+        """Writes the manifest to the source directory."""
+
+        with open(self.path, "wb") as f:
+            pickle.dump(self.entries, f, 2)
@@ -9,6 +9,8 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 import sys
 import re
 import os
+import json
+import pickle
 import fnmatch
 import Tkinter
 import tkFileDialog
@@ -16,7 +18,185 @@ import pandas
 import config
 import time
 import shutil
+from multiprocessing.pool import ThreadPool
 from util import query_yes_no
+from manifest import file_hash
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# Seconds, mtimes of copies on network and FAT drives are less precise
+mtime_tolerance = 2
+listing_name = "_proespm_listing.json"
+# Parsed worksheet next to the labjournal, e.g. '_proespm_labjournal.xlsx.pkl'
+labjournal_cache = "_proespm_{0}.pkl"
+# Labjournals read by this process, by path
+labjournals = {}
+
+
+def load_listing(listing_file, folder):
+    """Returns the stored listings of a folder, see find_files.
+
+    Python 2 lists a folder given as byte string with byte names, which are
+    stored as latin-1 text, so that any byte is kept. They are converted back.
+
+    Args:
+        listing_file (str): Path to the JSON file.
+        folder (str): Path to the searched folder.
+    """
+
+    try:
+        with open(listing_file) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if str is bytes and isinstance(folder, bytes):
+        cache = {
+            k.encode("latin-1"): dict(
+                entry,
+                files=[x.encode("latin-1") for x in entry["files"]],
+                dirs=[x.encode("latin-1") for x in entry["dirs"]],
+            )
+            for k, entry in cache.items()
+        }
+
+    return cache
+
+
+def save_listing(listing_file, listing):
+    """Stores the listings of a folder, see load_listing.
+
+    The listing is not stored if the folder is not writable or a name can
+    not be encoded.
+    """
+
+    options = {"encoding": "latin-1"} if str is bytes else {}
+    try:
+        with open(listing_file, "w") as f:
+            json.dump(listing, f, **options)
+    except (IOError, ValueError):
+        pass
+
+
+def list_dir(path):
+    """Returns the names of the files and of the subdirectories of a directory.
+
+    scandir gets the type of the entries from the directory listing itself,
+    without an additional stat call for each entry.
+    """
+
+    files, dirs = [], []
+    if scandir is not None:
+        for entry in scandir(path):
+            (dirs if entry.is_dir() else files).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            (dirs if os.path.isdir(os.path.join(path, name)) else files).append(name)
+
+    return files, dirs
+
+
+def list_cached(path, key, cache, listing):
+    """Returns the listing of a directory, from the cache if it is unchanged.
+
+    The content of a directory is unchanged if its mtime is the same as
+    when it was listed. Directories modified shortly before they were listed
+    are listed again, as the mtime resolution of network drives is low.
+
+    Args:
+        path (str): Path to the directory.
+        key (str): Path of the directory relative to the searched folder.
+        cache (dict): Previous listings by key.
+        listing (dict): New listings by key, the listing is added.
+
+    Returns:
+        entry (dict): 'mtime', 'listed', 'files' and 'dirs' of the directory.
+    """
+
+    mtime = os.stat(path).st_mtime
+    entry = cache.get(key)
+    if (
+        entry is None
+        or entry["mtime"] != mtime
+        or entry["listed"] - mtime <= mtime_tolerance
+    ):
+        files, dirs = list_dir(path)
+        entry = {"mtime": mtime, "listed": time.time(), "files": files, "dirs": dirs}
+    listing[key] = entry
+
+    return entry
+
+
+def walk_dir(path, key, cache, listing):
+    """Returns all files of a directory tree, directories starting with '_' are skipped.
+
+    Args:
+        path (str): Path to the directory.
+        key (str): Path of the directory relative to the searched folder.
+        cache (dict): Previous listings by key.
+        listing (dict): New listings by key, the listings are added.
+    """
+
+    entry = list_cached(path, key, cache, listing)
+    found = [os.path.join(path, f) for f in entry["files"]]
+    for d in entry["dirs"]:
+        if not d.startswith("_"):
+            found.extend(walk_dir(os.path.join(path, d), key + "/" + d, cache, listing))
+
+    return found
+
+
+def find_files(folder, file_types, threads=1):
+    """Finds all files of the given types in a folder and its subfolders.
+
+    Subfolders starting with '_', e.g. the exported data, are skipped. The
+    top level subfolders are searched by a pool of threads. The listings
+    are stored in the folder, so directories which have not changed since
+    the last search are not listed again.
+
+    Args:
+        folder (str): Path to the folder.
+        file_types (list): File endings, e.g. ['SM4', 'mpt'].
+        threads (int): Number of subfolders searched at the same time.
+
+    Returns:
+        input_files (list): Full path to the files in a list.
+    """
+
+    listing_file = os.path.join(folder, listing_name)
+    cache = load_listing(listing_file, folder)
+    listing = {}
+    entry = list_cached(folder, ".", cache, listing)
+    found = [os.path.join(folder, f) for f in entry["files"]]
+
+    subdirs = [d for d in entry["dirs"] if not d.startswith("_")]
+    listings = [{} for _ in subdirs]
+    pool = ThreadPool(processes=max(1, min(threads, len(subdirs))))
+    try:
+        results = pool.map(
+            lambda i: walk_dir(
+                os.path.join(folder, subdirs[i]), subdirs[i], cache, listings[i]
+            ),
+            range(len(subdirs)),
+        )
+    finally:
+        pool.close()
+        pool.join()
+    for files, sub_listing in zip(results, listings):
+        found.extend(files)
+        listing.update(sub_listing)
+
+    save_listing(listing_file, listing)
+
+    suffixes = tuple(file_types)
+    return [f for f in found if f.endswith(suffixes)]
 
 
 def prompt_folder():
@@ -35,14 +215,10 @@ def prompt_folder():
             )
             root.destroy()
 
-            for p, dirs, files in os.walk(folder, topdown=True):
-                dirs[:] = [d for d in dirs if not d.startswith("_")]
-                for f in files:
-                    if (
-                        f.endswith(tuple(config.allowed_file_types))
-                        and p.split("/")[len(p.split("/")) - 1][0] != "_"
-                    ):
-                        input_files.append(os.path.join(p, f))
+            if folder:
+                input_files = find_files(
+                    folder, config.allowed_file_types, config.copy_threads
+                )
 
             if not input_files:
                 raise IndexError
@@ -96,12 +272,7 @@ def prompt_labjournal():
             root = Tkinter.Tk()
             path_labj = tkFileDialog.askopenfiles(mode="rb", **config.dialog_labj)
             root.destroy()
-            labj = pandas.read_excel(
-                path_labj[0],
-                sheet_name=config.labj_ws_name,
-                dtypes=str,
-                converters={"ID": str},
-            )
+            labj = read_labjournal(path_labj[0].name)
 
         except IndexError:
             if not query_yes_no("You have not picked any files. Retry?"):
@@ -131,9 +302,126 @@ def grab_labjournal(path_labj):
     else:
         sys.exit("No labjournal was found!")
 
-    labj = pandas.read_excel(labj_file, sheet_name=config.labj_ws_name)
+    return read_labjournal(labj_file), labj_file
+
+
+def labjournal_columns():
+    """Returns the filter of the worksheet columns, None: all columns."""
+
+    if not config.labj_columns:
+        return None
+
+    columns = set(config.labj_columns) | set(["ID", "type"])
+    return lambda name: name in columns
+
+
+def read_labjournal(labj_file):
+    """Reads the labjournal worksheet of a xlsx file.
+
+    Parsing a large workbook takes long, so the worksheet is cached in a
+    pickle file next to the labjournal. The cache is used as long as size,
+    mtime and content hash of the labjournal match and the worksheet and
+    the columns were not changed in the config. Within one process, e.g.
+    in the watch mode, the labjournal is only read again when its size or
+    mtime changed.
+
+    Args:
+        labj_file (str): Path to the labjournal.
+
+    Returns:
+        labjournal (Pandas DF): Labjournal imported from xlsx file.
+    """
+
+    stat = os.stat(labj_file)
+    settings = [config.labj_ws_name, sorted(config.labj_columns)]
+    memo_key = [stat.st_size, stat.st_mtime, settings]
+    if labj_file in labjournals and labjournals[labj_file][0] == memo_key:
+        return labjournals[labj_file][1]
+
+    cache_file = os.path.join(
+        os.path.dirname(labj_file),
+        labjournal_cache.format(os.path.basename(labj_file)),
+    )
+    try:
+        with open(cache_file, "rb") as f:
+            cached = pickle.load(f)
+    except (IOError, EOFError, ValueError, ImportError, pickle.UnpicklingError):
+        cached = None
+
+    # Only hash the content if size and mtime match
+    if (
+        cached is not None
+        and cached["settings"] == settings
+        and cached["signature"][:2] == (stat.st_size, stat.st_mtime)
+        and cached["signature"][2] == file_hash(labj_file)
+    ):
+        labj = cached["labjournal"]
+    else:
+        labj = pandas.read_excel(
+            labj_file, sheet_name=config.labj_ws_name, usecols=labjournal_columns()
+        )
+        cached = {
+            "signature": (stat.st_size, stat.st_mtime, file_hash(labj_file)),
+            "settings": settings,
+            "labjournal": labj,
+        }
+        try:
+            with open(cache_file, "wb") as f:
+                pickle.dump(cached, f, 2)
+        except (IOError, OSError):
+            pass  # e.g. read-only share, the labjournal is parsed next time
+
+    labjournals[labj_file] = (memo_key, labj)
+
+    return labj
 
-    return labj, labj_file
+
+def normalize_id(labj_id):
+    """Converts a labjournal ID to the string format of the measurement IDs.
+
+    Excel stores numeric IDs (e.g. 271) as int or float, measurement IDs are
+    always strings.
+
+    Args:
+        labj_id: ID of a labjournal row.
+
+    Returns:
+        normalized_id (str): ID as string.
+    """
+
+    if isinstance(labj_id, float) and labj_id.is_integer():
+        labj_id = int(labj_id)
+
+    return str(labj_id).strip()
+
+
+def index_labjournal(labj):
+    """Creates a lookup table of the labjournal rows by their ID.
+
+    Rows without ID are ignored. If an ID occurs several times, the first
+    row is used.
+
+    Args:
+        labj (Pandas DF): Labjournal imported from xlsx file.
+
+    Returns:
+        index (dict): Labjournal rows (dict) by ID (str).
+        duplicates (list): IDs which occur more than once in the labjournal.
+    """
+
+    index = {}
+    duplicates = []
+    for row in labj.to_dict("records"):
+        if pandas.isnull(row["ID"]):
+            continue
+
+        key = normalize_id(row["ID"])
+        if key in index:
+            duplicates.append(key)
+        else:
+            index[key] = row
+
+    return index, duplicates
 
 
 def check_network_file(input_file):
@@ -155,7 +443,132 @@ def check_network_file(input_file):
     return False
 
 
-def move_files_temp(input_files, temp_dir):
+def is_current(src_file, dest_file):
+    """Checks if a copy has the size and the mtime of the source file.
+
+    Args:
+        src_file (str): Path to the source file.
+        dest_file (str): Path to the copy.
+    """
+
+    if not os.path.isfile(dest_file):
+        return False
+
+    src_stat, dest_stat = os.stat(src_file), os.stat(dest_file)
+    return (
+        src_stat.st_size == dest_stat.st_size
+        and abs(src_stat.st_mtime - dest_stat.st_mtime) <= mtime_tolerance
+    )
+
+
+def stage_file(src_file, temp_dir):
+    """Copies a file to the temporary folder, unless the copy is current.
+
+    Args:
+        src_file (str): Path to the source file.
+        temp_dir (str): Path to temporary folder.
+
+    Returns:
+        dest_file (str): Path to the copy.
+    """
+
+    dest_file = os.path.join(temp_dir, os.path.basename(src_file))
+    if not is_current(src_file, dest_file):
+        shutil.copy2(src_file, dest_file)
+        if not is_current(src_file, dest_file):
+            raise IOError("Copy of " + src_file + " is incomplete.")
+
+    return dest_file
+
+
+class StagedFiles(object):
+    """Copies files to the temporary folder in the background.
+
+    The files are copied by a pool of threads in the given order, so files
+    which are processed first should be given first. The processing of a
+    file can start as soon as its copy is complete, see wait.
+
+    Args:
+        input_files (list): Files which will be copied.
+        temp_dir (str): Path to temporary folder.
+        threads (int): Number of files copied at the same time.
+    """
+
+    def __init__(self, input_files, temp_dir, threads=4):
+        if temp_dir is None:
+            sys.exit("No temp directory was created!")
+
+        self.temp_dir = temp_dir
+        self.pool = ThreadPool(processes=max(1, threads))
+        self.pending = {}
+        self.files = []
+        self.add(input_files)
+
+    def add(self, input_files):
+        """Copies further files after the files given so far.
+
+        E.g. unchanged files whose previous results can not be reused.
+
+        Args:
+            input_files (list): Files which will be copied.
+
+        Returns:
+            proc_files (list): Paths to the files in the temporary folder.
+        """
+
+        proc_files = []
+        for f in input_files:
+            dest_file = os.path.join(self.temp_dir, os.path.basename(f))
+            self.pending[dest_file] = self.pool.apply_async(
+                stage_file, (f, self.temp_dir)
+            )
+            proc_files.append(dest_file)
+        self.files.extend(proc_files)
+
+        return proc_files
+
+    def is_staged(self, proc_file):
+        """Checks if a file is in the temporary folder, e.g. a split mul file."""
+
+        return os.path.dirname(os.path.abspath(proc_file)) == os.path.abspath(
+            self.temp_dir
+        )
+
+    def wait(self, proc_file):
+        """Blocks until the copy of a file is complete.
+
+        Errors of the copy are raised here. Files which are not staged are
+        returned immediately.
+
+        Args:
+            proc_file (str): Path to the file in the temporary folder.
+
+        Returns:
+            proc_file (str): Path to the file in the temporary folder.
+        """
+
+        result = self.pending.pop(proc_file, None)
+        if result is not None:
+            result.get()
+
+        return proc_file
+
+    def join(self):
+        """Blocks until all copies are complete, no files can be added anymore."""
+
+        self.pool.close()
+        for proc_file in list(self.pending):
+            self.wait(proc_file)
+        self.pool.join()
+
+    def terminate(self):
+        """Stops the copying, files which are being copied are finished."""
+
+        self.pool.terminate()
+        self.pool.join()
+
+
+def move_files_temp(input_files, temp_dir, threads=1):
     """Move files to a new created temporary folder on local drive.
 
     The function will first check, if there is temporary location on the OS.
@@ -165,20 +578,16 @@ def move_files_temp(input_files, temp_dir):
     Args:
         input_files (list): Files which will be moved to a temporary folder.
         temp_dir (str): Path to temporary folder.
+        threads (int): Number of files copied at the same time.
 
     Returns:
         process_files (list): List of paths to the files in a temporary folder.
     """
 
-    if temp_dir is None:
-        sys.exit("No temp directory was created!")
-    else:
-        process_files = []
-        for f in input_files:
-            shutil.copy2(os.path.join(f), temp_dir)
-            process_files.append(os.path.join(temp_dir, os.path.basename(f)))
+    staged = StagedFiles(input_files, temp_dir, threads)
+    staged.join()
 
-    return process_files
+    return staged.files
 
 
 def copy_user_config(src_dir):
@@ -188,9 +597,7 @@ def copy_user_config(src_dir):
         src_dir (str): Path to source directory.
     """
 
-    config_path = os.path.join(os.path.split(sys.path[0])[0], "config.yml")
-
-    with open(config_path, "r") as f:
+    with open(config.config_file, "r") as f:
         log_f = f.read()
 
     with open(os.path.join(src_dir, "_config.log"), "a") as f:
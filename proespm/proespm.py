@@ -8,6 +8,14 @@ Example:
 
         $ python2 proespm.py
 
+    Without dialogs, e.g. for several folders on a server:
+
+        $ python2 proespm.py --src /data/folder1 --src /data/folder2 --jobs 4
+
+    Processing new files as soon as they are written, until Ctrl+C:
+
+        $ python2 proespm.py --src /data/folder1 --watch
+
 
 (C) Copyright Nicolas Bock, licensed under GPL v3
 See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
@@ -15,29 +23,43 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 
 from __future__ import print_function
 import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
 from os.path import dirname, abspath, join
 import shutil
 import tempfile
+import functools
 from itertools import chain
 import prep
 import config
 import html
+import watch
+import timing
+import render
 import gwyddion
 from data import m_id, Image
 from spm import Ecstm, Stm, Afm
 from sem import Sem
 from ec import Cv, Peis, Chrono
 from spectroscopy import Raman, Xps
-from util import progress_bar, multiple_move
+from util import Publisher
 from log import Logging
+from manifest import Manifest
 
 
-def prompt():
+def prompt(labj_file=None):
     """Prompts for the files, which will be processed.
 
+    Args:
+        labj_file (str): Path to the labjournal, None: depends on the config.
+
     Returns:
         input_fs (list): List of all files (full path) selected by the user.
-        labjournal (str): Path to the labjournal.
+        labjournal (dict): Labjournal rows by ID.
         src_dir (str): Source directory.
     """
 
@@ -69,27 +91,68 @@ def prompt():
     else:
         input_fs, src_dir = prep.prompt_folder()
 
-    if config.is_labj and not config.is_labj_prompt and not config.debug_modus:
-        labjournal, path_labj = prep.grab_labjournal(os.path.split(src_dir)[0])
-        l.log_p(8, ">>> Imported labjournal from " + path_labj)
-    elif config.is_labj and config.is_labj_prompt and not config.debug_modus:
-        labjournal, path_labj = prep.prompt_labjournal()
-        l.log_p(8, ">>> Imported labjournal from " + path_labj)
+    labjournal = load_labjournal(src_dir, labj_file)
+    l.log_p(4, ">>> Source directory: " + src_dir)
+
+    return src_dir, input_fs, labjournal
+
+
+def load_labjournal(src_dir, labj_file=None, interactive=True):
+    """Imports the labjournal and indexes its rows by ID.
+
+    Args:
+        src_dir (str): Source directory, the labjournal is searched in its
+                       parent folder.
+        labj_file (str): Path to the labjournal, None: depends on the config.
+        interactive (bool): False: never prompt for the labjournal.
+
+    Returns:
+        labjournal (dict): Labjournal rows by ID.
+    """
+
+    if labj_file is not None:
+        labjournal, path_labj = prep.read_labjournal(labj_file), labj_file
     elif config.debug_modus:
         labjournal, path_labj = prep.grab_labjournal(
             os.path.abspath(os.path.join(src_dir, os.pardir))
         )
-        l.log_p(8, ">>> Imported labjournal from " + path_labj)
+    elif config.is_labj and config.is_labj_prompt and interactive:
+        labjournal, path_labj = prep.prompt_labjournal()
+    elif config.is_labj:
+        labjournal, path_labj = prep.grab_labjournal(os.path.split(src_dir)[0])
     else:
-        labjournal = ""
-        path_labj = ""
+        return {}
 
-    l.log_p(4, ">>> Source directory: " + src_dir)
+    l.log_p(8, ">>> Imported labjournal from " + path_labj)
+    labjournal, duplicates = prep.index_labjournal(labjournal)
+    if duplicates:
+        l.log_p(2, ">>> Duplicate IDs in labjournal: " + ", ".join(duplicates))
 
-    return src_dir, input_fs, labjournal
+    return labjournal
 
 
-def prepare(src_dir, input_fs, temp_dir):
+def find_sources(src):
+    """Returns the files of a folder or a single file given on the command line.
+
+    Args:
+        src (str): Path to a folder or to a file.
+
+    Returns:
+        src_dir (str): Source directory.
+        input_fs (list): List of all files (full path).
+    """
+
+    # The network drive detection expects forward slashes
+    src = os.path.abspath(src).replace("\\", "/")
+    if not os.path.exists(src):
+        raise IOError("No such file or folder: " + src)
+    if os.path.isdir(src):
+        return src, prep.find_files(src, config.allowed_file_types, config.copy_threads)
+
+    return os.path.dirname(src), [src]
+
+
+def prepare(src_dir, input_fs, temp_dir, manifest=None):
     """Preparation of all the files for the actual data manipulation.
 
     Args:
@@ -97,186 +160,700 @@ def prepare(src_dir, input_fs, temp_dir):
         input_fs (list): List of paths to files, which should be prepared.
         temp_dir (str): The link to the temp_file. It created outside of the main loop, to
                         assure cleanup on raised error.
+        manifest (Manifest): Optional run manifest, unchanged files are not copied.
     Returns:
         proc_dir (str): Directory where the are copied and created while processing.
         proc_fs (list): List of paths to files, which will processed.
+        staged (StagedFiles): Files being copied to the temporary folder, None
+                              if the files are processed in place.
     """
 
     l.log_p(8, ">>> Starting data import")
 
     if prep.check_network_file(input_fs[0]):
         l.log_p(2, ">>> Files are on a network drive")
-        proc_fs = prep.move_files_temp(input_fs, temp_dir)
-        l.log_p(3, ">>> Copied files to local TEMP directory: " + temp_dir)
+        unchanged_fs = []
+        if manifest is not None:
+            # Split mul files are written next to the mul file, always copy them
+            unchanged_fs = [
+                f
+                for f in input_fs
+                if not f.endswith(".mul") and manifest.is_unchanged(f)
+            ]
+            l.log_p(
+                3, ">>> {0} unchanged files are not copied".format(len(unchanged_fs))
+            )
+        skip_fs = set(unchanged_fs)
+        # Copy in the order of the processing, mul files are split beforehand
+        copy_fs = sorted(
+            (f for f in input_fs if f not in skip_fs),
+            key=lambda f: (not f.endswith(".mul"), os.path.basename(f)),
+        )
+        staged = prep.StagedFiles(copy_fs, temp_dir, config.copy_threads)
+        proc_fs = staged.files
+        if manifest is not None:
+            for proc_f, src_f in zip(proc_fs, copy_fs):
+                manifest.track(proc_f, src_f)
+        proc_fs = proc_fs + unchanged_fs
+        proc_dir = temp_dir
+        # Same order as if all files had been copied to the temporary folder
+        sort_key = os.path.basename
+        l.log_p(3, ">>> Copying files to local TEMP directory: " + temp_dir)
     else:
         l.log_p(2, ">>> Files are stored locally")
         proc_fs = input_fs  # use the input files directly
+        proc_dir = os.path.dirname(proc_fs[0])
+        sort_key = None
+        staged = None
 
-    proc_dir = os.path.dirname(proc_fs[0])
     l.log_p(4, ">>> Processing directory: " + proc_dir)
     l.log_p(4, ">>> Creating userconfig.log in " + src_dir)
     prep.copy_user_config(src_dir)
     l.log_p(0, "")
 
-    mul_files = [gwyddion.mul_split(f) for f in proc_fs if f.endswith(".mul")]
+    mul_files = [
+        gwyddion.mul_split(staged.wait(f) if staged else f)
+        for f in proc_fs
+        if f.endswith(".mul")
+    ]
     mul_files_flat = list(chain.from_iterable(mul_files))
-    proc_fs = sorted(proc_fs + mul_files_flat, reverse=False)
+    proc_fs = sorted(proc_fs + mul_files_flat, key=sort_key, reverse=False)
 
-    return proc_dir, proc_fs
+    return proc_dir, proc_fs, staged
 
 
-def main(src_dir, proc_dir, proc_fs, labjournal):
-    """Main loop which batch process the files, which are imported via the
-    GUI file dialog.
+CLASSES = {
+    "image": Image,
+    "stm": Stm,
+    "ecstm": Ecstm,
+    "afm": Afm,
+    "sem": Sem,
+    "cv": Cv,
+    "peis": Peis,
+    "chrono": Chrono,
+    "raman": Raman,
+    "xps": Xps,
+}
 
-    Args:
-        src_dir (str): Path to the original folder of the files.
-        proc_dir (str): Can be the same as src_dir, depends if files are on server.
-        proc_fs (list): List of all files (with full path).
-        labjournal (pd-df): Labjournal as pandas dataframe.
-    """
 
-    proc_items = []
-    l.log_p(5, ">>> Starting data processing")
+def process_item(task):
+    """Imports one file and runs all the processing and export functions.
 
-    for i, dat in enumerate(proc_fs):
-        if config.log_level < 5:
-            progress_bar(
-                i + 1, len(proc_fs), prefix="Progress:", suffix="complete", length=50
-            )
+    This function is executed in the main process or, if more than one
+    worker is configured, in a worker process. Each worker process owns its
+    own Gwyddion data browser state.
 
-        is_append = True
-        labjournal_error = False
-        data_id = m_id(dat)
-        if config.is_labj:
-            # This is a workarround, as the 'ID' pandas colomn does not
-            # contain str values only, but also int; The pandas.read_excel
-            # function optional conversion does not work properly. The old
-            # expression: add_arg = labjournal[labjournal['ID'] == data_id]
-            for x in labjournal["ID"]:
-                if str(x) == str(data_id):
-                    add_arg = labjournal[labjournal["ID"] == x]
-                    add_arg = add_arg.iloc[0].to_dict()
-                    break
-            else:
-                labjournal_error = True
-
-        classes = {
-            "image": Image,
-            "stm": Stm,
-            "ecstm": Ecstm,
-            "afm": Afm,
-            "sem": Sem,
-            "cv": Cv,
-            "peis": Peis,
-            "chrono": Chrono,
-            "raman": Raman,
-            "xps": Xps,
-        }
-
-        if labjournal_error or not config.is_labj:
-            item = classes.get(config.m_type)(dat, **add_arg)
-        else:
-            item = classes.get(add_arg["type"])(dat, **add_arg)
+    Args:
+        task (tuple): Measurement type, path of the file, processing
+                      directory and the labjournal entry (dict) of the file.
+
+    Returns:
+        item (Data): Processed measurement item.
+    """
 
-        l.log_p(10, ">>> {0} loaded: {1}".format(type(item).__name__, str(data_id)))
+    m_type, dat, proc_dir, add_arg = task
+    timer = timing.Timer(config.is_profile and config.profile_slowest > 0)
+    with timer.stage("load"):
+        item = CLASSES.get(m_type)(dat, **add_arg)
 
-        # STM specific functions
-        if type(item).__name__ in ["Stm", "Ecstm", "Afm"]:
+    # STM specific functions
+    if type(item).__name__ in ["Stm", "Ecstm", "Afm"]:
+        with timer.stage("process"):
             item.process_topo_fwd()
+        with timer.stage("save image"):
             item.save_topo_fwd_image(proc_dir)
+        with timer.stage("save data"):
             item.save_topo_fwd_data(proc_dir)
+        with timer.stage("process"):
             item.process_topo_bwd()
+        with timer.stage("save image"):
             item.save_topo_bwd_image(proc_dir)
+        with timer.stage("save data"):
             item.save_topo_bwd_data(proc_dir)
 
-        # AFM specific functions
-        if type(item).__name__ in ["Afm"]:
-            if "item.type" in locals() and item.type != "Dynamic Force":
+    # AFM specific functions
+    if type(item).__name__ in ["Afm"]:
+        if "item.type" in locals() and item.type != "Dynamic Force":
+            with timer.stage("save image"):
                 item.save_phase_bwd_image(proc_dir)
                 item.save_phase_fwd_image(proc_dir)
 
-        # ECSTM specific functions
-        if type(item).__name__ in ["Ecstm"]:
+    # ECSTM specific functions
+    if type(item).__name__ in ["Ecstm"]:
+        with timer.stage("save data"):
             item.save_ec_data(proc_dir)
             item.save_ic_data(proc_dir)
             item.save_u_tun_data(proc_dir)
 
-        # CV specific functions
-        if type(item).__name__ in ["Cv"]:
+    # CV specific functions
+    if type(item).__name__ in ["Cv"]:
+        with timer.stage("save data"):
             item.save_ec(proc_dir)
-            if not item.m_id.endswith("1") and item.m_file.endswith(".txt"):
-                x = len(proc_items) - 1
-                proc_items[x].append_cycle(item.data, item.m_id, item.remark)
-                l.log_p(4, ">>> CV files " + proc_items[x].m_id + " are combined.")
-
-                # As data has been appended to previous item, do not add
-                # it to the html report
-                is_append = False
 
-        # SEM specific functions
-        if type(item).__name__ in ["Sem"]:
+    # SEM specific functions
+    if type(item).__name__ in ["Sem"]:
+        with timer.stage("save image"):
             item.save_image(proc_dir)
 
-        if is_append:
-            proc_items.append(item)
-
-        # Workaround of Gwyddion bug: C RAM allocation fails
-        if type(item).__name__ in ["Stm", "Ecstm", "Afm"]:
+    # Workaround of Gwyddion bug: C RAM allocation fails
+    if type(item).__name__ in ["Stm", "Ecstm", "Afm"]:
+        with timer.stage("flush"):
             item.flush_memory()
 
+    if config.is_profile:
+        # Passed with the item from the worker process, see timing.Profile
+        timer.finish()
+        item.timer = timer
+
+    return item
+
+
+def process_items(tasks, manifest=None, dirs=(), staged=None, pool=None):
+    """Processes all tasks, either serially or with a pool of processes.
+
+    The items are returned in the order of the tasks, so the result is the
+    same for the serial and the parallel execution. Items of unchanged files
+    are taken from the manifest.
+
+    Args:
+        tasks (list): Tasks as expected by process_item.
+        manifest (Manifest): Optional run manifest.
+        dirs (list): Directories where previously exported files are searched.
+        staged (StagedFiles): Files being copied to the temporary folder.
+        pool (multiprocessing.Pool): Worker processes, see run_tasks.
+
+    Yields:
+        item (Data): Processed measurement item.
+    """
+
+    cached = {}
+    if manifest is not None:
+        for i, (m_type, dat, _, add_arg) in enumerate(tasks):
+            item = manifest.lookup(dat, CLASSES.get(m_type).__name__, dirs)
+            if item is not None:
+                # The labjournal entry may have been edited in the meantime
+                item.update_meta(**add_arg)
+                cached[i] = item
+        l.log_p(5, ">>> {0} unchanged files are skipped".format(len(cached)))
+
+    pending = [task for i, task in enumerate(tasks) if i not in cached]
+    if staged is not None:
+        pending = stage_pending(pending, staged, manifest)
+    processed = run_tasks(ready_tasks(pending, staged), pool)
+    for i, task in enumerate(tasks):
+        item = cached[i] if i in cached else next(processed)
+        if timing.current is not None:
+            timing.current.track(item)
+        if manifest is not None and i not in cached:
+            manifest.record(task[1], item)
+        yield item
+    processed.close()
+
+
+def stage_pending(tasks, staged, manifest=None):
+    """Copies the files of tasks which are still on the network drive.
+
+    Unchanged files are not copied by prepare, but their previous result
+    can not be reused, e.g. if the configuration changed or an exported
+    file was deleted. They are copied now instead of processed over the
+    network.
+
+    Args:
+        tasks (list): Tasks as expected by process_item.
+        staged (StagedFiles): Files being copied to the temporary folder.
+        manifest (Manifest): Optional run manifest.
+
+    Returns:
+        tasks (list): Tasks with the paths in the temporary folder.
+    """
+
+    remote = [task[1] for task in tasks if not staged.is_staged(task[1])]
+    if not remote:
+        return tasks
+
+    l.log_p(5, ">>> {0} unchanged files are copied again".format(len(remote)))
+    local = dict(zip(remote, staged.add(remote)))
+    if manifest is not None:
+        for src_f, proc_f in local.items():
+            manifest.track(proc_f, src_f)
+
+    return [(t[0], local.get(t[1], t[1]), t[2], t[3]) for t in tasks]
+
+
+def ready_tasks(tasks, staged=None):
+    """Yields the tasks as soon as their files are copied.
+
+    Args:
+        tasks (list): Tasks as expected by process_item.
+        staged (StagedFiles): Files being copied to the temporary folder,
+                              None if the files are processed in place.
+    """
+
+    for task in tasks:
+        if staged is not None:
+            staged.wait(task[1])
+        yield task
+
+
+def run_tasks(tasks, pool=None):
+    """Runs process_item for all tasks in the given order.
+
+    The tasks are requested one after the other, so they can be generated
+    while the processing is running.
+
+    Args:
+        tasks (iterable): Tasks as expected by process_item.
+        pool (multiprocessing.Pool): Worker processes kept between runs,
+                                     None: a pool is created if configured.
+
+    Yields:
+        item (Data): Processed measurement item.
+    """
+
+    if pool is not None:
+        for item in pool.imap(process_item, tasks):
+            yield item
+    elif config.workers > 1:
+        pool = multiprocessing.Pool(processes=config.workers)
+        try:
+            for item in pool.imap(process_item, tasks):
+                yield item
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            yield process_item(task)
+
+
+def main(
+    src_dir,
+    proc_dir,
+    proc_fs,
+    labjournal,
+    manifest=None,
+    staged=None,
+    publisher=None,
+    pool=None,
+):
+    """Main loop which batch process the files, which are imported via the
+    GUI file dialog.
+
+    Args:
+        src_dir (str): Path to the original folder of the files.
+        proc_dir (str): Can be the same as src_dir, depends if files are on server.
+        proc_fs (list): List of all files (with full path).
+        labjournal (dict): Labjournal rows by ID, see prep.index_labjournal.
+        manifest (Manifest): Optional run manifest to skip unchanged files.
+        staged (StagedFiles): Files being copied to the temporary folder, a
+                              file is processed as soon as its copy is complete.
+        publisher (Publisher): Moves the files of an item to their final
+                               destination once it is processed and rendered.
+        pool (multiprocessing.Pool): Worker processes, see run_tasks.
+    """
+
+    tasks = []
+    l.log_p(5, ">>> Starting data processing")
+    if config.workers > 1:
+        l.log_p(5, ">>> Processing with {0} worker processes".format(config.workers))
+
+    for dat in proc_fs:
+        add_arg = labjournal.get(m_id(dat), {})
+        if add_arg:
+            tasks.append((add_arg["type"], dat, proc_dir, add_arg))
+        else:
+            tasks.append((config.m_type, dat, proc_dir, add_arg))
+
+    dirs = [
+        proc_dir,
+        os.path.join(src_dir, "_png"),
+        os.path.join(src_dir, "_data"),
+        src_dir,
+    ]
+
+    def processed():  # pylint: disable=missing-docstring
+        for i, item in enumerate(process_items(tasks, manifest, dirs, staged, pool)):
+            if config.log_level < 5:
+                l.progress(
+                    i + 1, len(tasks), prefix="Progress:", suffix="complete", length=50
+                )
+
+            l.log_p(10, ">>> {0} loaded: {1}".format(type(item).__name__, item.m_id))
+            yield item
+
+    def done(item):  # pylint: disable=missing-docstring
+        if timing.current is not None:
+            timing.current.finish(item)
+        if publisher is not None:
+            publish_item(publisher, item)
+
+    proc_items = merge_cv(processed())
+    if config.is_html_out and config.report_window:
+        # The report is written while the files are processed
+        l.log_p(2, ">>> Create HTML report.")
+        html.create_html(
+            src_dir,
+            proc_dir,
+            proc_items,
+            config.report_window,
+            config.report_pages,
+            done,
+        )
+        l.log_p(2, ">>> HTML report created.")
+    elif config.is_html_out:
+        proc_items = list(proc_items)
+    else:
+        for item in proc_items:
+            done(item)
+
     l.log_p(8, "")
     l.log_p(8, ">>> Finished data processing.")
 
-    if config.is_html_out:
+    if config.is_html_out and not config.report_window:
         l.log_p(2, ">>> Create HTML report.")
         sorted_items = sorted(proc_items, key=lambda x: x.datetime, reverse=False)
-        html.create_html(src_dir, proc_dir, sorted_items)
+        html.create_html(
+            src_dir, proc_dir, sorted_items, split=config.report_pages, done=done
+        )
         l.log_p(2, ">>> HTML report created.")
 
 
-def cleanup(src_dir, proc_dir):
+def merge_cv(items):
+    """Combines CV files which contain only one cycle with the previous item.
+
+    Some measurement programms export each CV cycle in a new file. An item
+    is only yielded when the next item is not one of its cycles.
+
+    Args:
+        items (iterable): Processed measurement items.
+
+    Yields:
+        item (Data): Measurement item.
+    """
+
+    previous = None
+    for item in items:
+        if (
+            previous is not None
+            and type(item).__name__ in ["Cv"]
+            and not item.m_id.endswith("1")
+            and item.m_file.endswith(".txt")
+        ):
+            previous.append_cycle(item.trace, item.m_id, item.remark)
+            l.log_p(4, ">>> CV files " + previous.m_id + " are combined.")
+            continue
+
+        if previous is not None:
+            yield previous
+        previous = item
+
+    if previous is not None:
+        yield previous
+
+
+def publish_item(publisher, item):
+    """Starts moving the exported files of an item and their thumbnails.
+
+    Args:
+        publisher (Publisher): Moves the files to their final destination.
+        item (Data): Processed measurement item.
+    """
+
+    files = item.exported_files()
+    publisher.publish(
+        files + [render.thumb_file(f) for f in files if f.endswith(".png")]
+    )
+
+
+def publish_rules(src_dir):
+    """Returns the final destinations of the result files, see Publisher.
+
+    Args:
+        src_dir (str): Path to the original folder of the files.
+    """
+
+    if config.hierarchy:
+        return [
+            (["ec.txt", "0", "gwy"], os.path.join(src_dir, "_data")),
+            (["png"], os.path.join(src_dir, "_png")),
+            (["html", "js"], os.path.split(src_dir)[0]),
+        ]
+    if prep.check_network_file(src_dir[0]):
+        return [(["png", "0", "ec.txt", "html", "js"], src_dir)]
+
+    return []
+
+
+def cleanup(src_dir, proc_dir, publisher=None):
     """The cleanup procedure after the data manipulation.
 
+    The files which were not published during the processing are moved
+    now, the source folder is listed only once.
+
     Args:
         src_dir (str): Path to the original folder of the files.
         proc_dir (str): Can be the same as src_dir, depends if files are on server.
+        publisher (Publisher): Publisher used during the processing.
     """
 
     l.log_p(2, "")
 
-    if config.hierarchy:
+    if publisher is None:
+        publisher = Publisher(proc_dir, publish_rules(src_dir), config.copy_threads)
+    if publisher.rules:
         l.log_p(9, ">>> Move data to final destination.")
-        if not multiple_move(
-            proc_dir,
-            src_dir,
-            ["ec.txt", "0", "gwy"],
-            hierarchy="sub",
-            subfolder_name="_data",
-        ):
-            l.log_p(10, ">>> No data files were not moved.")
-        if not multiple_move(
-            proc_dir, src_dir, ["png"], hierarchy="sub", subfolder_name="_png"
-        ):
-            l.log_p(10, ">>> No images files were not moved.")
-        if not multiple_move(proc_dir, src_dir, ["html"], hierarchy="parent"):
-            l.log_p(10, ">>> No HTML report was moved.")
-    elif prep.check_network_file(src_dir[0]):
-        l.log_p(9, ">>> Move data and remove temporary folder")
-        multiple_move(proc_dir, src_dir, ["png", "0", "ec.txt", "html"])
+        publisher.publish_all()
+        moved = publisher.join()
+        if not moved:
+            l.log_p(10, ">>> No files were moved.")
+        else:
+            l.log_p(10, ">>> {0} files were moved.".format(moved))
 
     l.log_p(0, ">>>                  DONE                   <<<")
 
 
-if __name__ == "__main__":
+def run(src_dir, input_fs, labjournal, manifest=None, pool=None):
+    """Processes the files of one source directory.
+
+    Args:
+        src_dir (str): Source directory.
+        input_fs (list): List of all files (full path).
+        labjournal (dict): Labjournal rows by ID.
+        manifest (Manifest): Manifest kept between runs, None: read the
+                             manifest of the source directory if the files
+                             are processed incrementally.
+        pool (multiprocessing.Pool): Worker processes kept between runs.
+
+    Returns:
+        n_files (int): Number of processed files, incl. split mul files.
+    """
+
     temp = tempfile.mkdtemp(prefix="python_", suffix="_temp")
-    l = Logging()
+    stage = None
+    publ = None
 
     try:
-        src, fs, labj = prompt()
-        pdir, proc = prepare(src, fs, temp)
-        main(src, pdir, proc, labj)
-        cleanup(src, pdir)
-        l.save_log(src, config.log_f_name)
+        mani = manifest
+        if mani is None and config.is_incremental:
+            mani = Manifest(src_dir)
+        if config.is_profile:
+            timing.current = timing.Profile(config.profile_slowest)
+        pdir, proc, stage = prepare(src_dir, input_fs, temp, mani)
+        publ = Publisher(pdir, publish_rules(src_dir), config.copy_threads)
+        main(src_dir, pdir, proc, labjournal, mani, stage, publ, pool)
+        cleanup(src_dir, pdir, publ)
+        if mani is not None:
+            mani.save()
+        if timing.current is not None:
+            for path in timing.current.write(src_dir):
+                l.log_p(4, ">>> Profile written to " + path)
+        l.save_log(src_dir, config.log_f_name)
     finally:
+        timing.current = None
+        if stage is not None:
+            stage.terminate()
+        if publ is not None:
+            publ.terminate()
+        l.flush()
         shutil.rmtree(temp)
+
+    return len(proc)
+
+
+def batch(sources, labj_file=None):
+    """Processes several folders or files without any dialog.
+
+    A failure of one source is recorded and the next source is processed.
+
+    Args:
+        sources (list): Paths to folders or files.
+        labj_file (str): Path to the labjournal of all sources, None: depends
+                         on the config, but the labjournal is never prompted.
+
+    Returns:
+        summary (dict): Timings and failures of the sources.
+    """
+
+    summary = {"sources": [], "failed": 0, "seconds": 0.0}
+    labjournal = None
+    start = time.time()
+    for src in sources:
+        result = {"src": src, "files": 0, "status": "ok", "error": None}
+        src_start = time.time()
+        try:
+            src_dir, input_fs = find_sources(src)
+            if not input_fs:
+                raise ValueError("No files to process in " + src)
+
+            if labj_file is None:
+                labjournal = load_labjournal(src_dir, interactive=False)
+            elif labjournal is None:
+                labjournal = load_labjournal(src_dir, labj_file)
+            l.log_p(4, ">>> Source directory: " + src_dir)
+            result["files"] = run(src_dir, input_fs, labjournal)
+        except (Exception, SystemExit) as e:  # pylint: disable=broad-except
+            result["status"] = "failed"
+            result["error"] = "{0}: {1}".format(type(e).__name__, e)
+            summary["failed"] += 1
+            l.log_p(0, ">>> Processing of " + src + " failed:")
+            l.log_p(0, traceback.format_exc())
+        result["seconds"] = round(time.time() - src_start, 3)
+        summary["sources"].append(result)
+        l.clear()
+    summary["seconds"] = round(time.time() - start, 3)
+
+    return summary
+
+
+def is_result(m_file, ids):
+    """Checks if a file is named like the results of the measurement IDs."""
+
+    name = os.path.basename(m_file)
+    for x in ids:
+        if name.startswith((x + "_", x + ".", "g" + x + "_")):
+            return True
+
+    return False
+
+
+def watch_sources(sources, labj_file=None):
+    """Processes new files in the source folders until Ctrl+C is pressed.
+
+    All files are processed when the watching starts. Then each new file is
+    processed as soon as it is written completely. The Gwyddion module,
+    the labjournals and the manifests stay loaded, so only the new files
+    are processed and the report pages without new items are kept. A
+    labjournal is only read again when it was changed.
+
+    Args:
+        sources (list): Paths to folders.
+        labj_file (str): Path to the labjournal of all sources, None: depends
+                         on the config, but the labjournal is never prompted.
+    """
+
+    folders = []
+    labjournals = {}
+    manifests = {}
+    for src in sources:
+        src_dir = os.path.abspath(src).replace("\\", "/")
+        if not os.path.isdir(src_dir):
+            raise IOError("No such folder: " + src)
+        labjournals[src_dir] = load_labjournal(src_dir, labj_file, interactive=False)
+        manifests[src_dir] = Manifest(src_dir)
+        folders.append(
+            watch.Folder(src_dir, config.allowed_file_types, config.watch_settle)
+        )
+    html.written_pages = {}
+    # The workers and their Gwyddion instances are started only once
+    pool = None
+    if config.workers > 1:
+        pool = multiprocessing.Pool(processes=config.workers)
+
+    def process(folder, new_fs):  # pylint: disable=missing-docstring
+        l.log_p(4, ">>> {0} new files in {1}".format(len(new_fs), folder.src_dir))
+        before = set(folder.files)
+        ids = set(str(m_id(f)) for f in new_fs)
+        manifests[folder.src_dir].refresh()
+        try:
+            # Only read again if the labjournal was saved in the meantime
+            labjournals[folder.src_dir] = load_labjournal(
+                folder.src_dir, labj_file, interactive=False
+            )
+        except Exception:  # pylint: disable=broad-except
+            l.log_p(2, ">>> Labjournal could not be read, the previous one is used.")
+        try:
+            run(
+                folder.src_dir,
+                folder.current_files(),
+                labjournals[folder.src_dir],
+                manifests[folder.src_dir],
+                pool,
+            )
+        except Exception:  # pylint: disable=broad-except
+            l.log_p(0, ">>> Processing of " + folder.src_dir + " failed:")
+            l.log_p(0, traceback.format_exc())
+        l.clear()
+
+        # Results which are moved to the source folder are not measurements
+        folder.scan()
+        folder.ignore(f for f in folder.files if f not in before and is_result(f, ids))
+
+    try:
+        watch.watch(
+            folders, process, config.watch_interval, functools.partial(l.log_p, 2)
+        )
+    except KeyboardInterrupt:
+        l.log_p(2, ">>> Watching stopped.")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def parse_args(argv=None):
+    """Parses the command line arguments."""
+
+    parser = argparse.ArgumentParser(
+        description="Batch processing of surface science data."
+    )
+    parser.add_argument(
+        "--src",
+        action="append",
+        help="folder or file to process, can be given several times; "
+        "without --src the files are selected in a dialog",
+    )
+    parser.add_argument("--labjournal", help="path to the xlsx labjournal")
+    parser.add_argument(
+        "--config",
+        help="path to the configuration file, the system paths are always "
+        "read from config.yml or the PROESPM_CONFIG environment variable",
+    )
+    parser.add_argument("--jobs", type=int, help="number of worker processes")
+    parser.add_argument(
+        "--output", help="path of the JSON summary of a --src run, default: stdout"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and process new files of the --src folders",
+    )
+
+    return parser.parse_args(argv)
+
+
+def write_summary(summary, output=None):
+    """Writes the summary of a batch run as JSON.
+
+    Args:
+        summary (dict): Summary, see batch.
+        output (str): Path of the JSON file, None: print to stdout.
+    """
+
+    text = json.dumps(summary, indent=2, sort_keys=True)
+    if output is None:
+        print(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.config is not None:
+        config.load(args.config)
+    if args.jobs is not None:
+        config.workers = args.jobs
+    l = Logging()
+
+    if args.watch:
+        if not args.src:
+            sys.exit("--watch needs at least one --src folder")
+        watch_sources(args.src, args.labjournal)
+    elif args.src:
+        summ = batch(args.src, args.labjournal)
+        l.flush()
+        write_summary(summ, args.output)
+        sys.exit(1 if summ["failed"] else 0)
+    else:
+        src, fs, labj = prompt(args.labjournal)
+        run(src, fs, labj)
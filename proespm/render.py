@@ -0,0 +1,270 @@
+"""render.py
+
+Part of proespm: Rendering of data channels to PNG images.
+
+The data is mapped through a 256 color lookup table and encoded as PNG
+with zlib, without the Gwyddion export pipeline.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import struct
+import zlib
+import numpy as np
+
+
+# Gwyddion color range types (/base/range-type)
+range_full = 0
+range_fixed = 1
+range_auto = 2
+range_adaptive = 3
+
+# Percentage of the values cut off at each end for the automatic range
+auto_cut = 0.5
+
+# Edge length in pixels of the tiles of the image pyramid
+tile_size = 256
+
+# Color stops (position, red, green, blue) of the gradients, Gwyddion names
+gradients = {
+    "gray": [(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 1.0, 1.0)],
+    "gold": [
+        (0.0, 0.0, 0.0, 0.0),
+        (0.35, 0.57, 0.26, 0.0),
+        (0.7, 0.97, 0.72, 0.2),
+        (1.0, 1.0, 1.0, 1.0),
+    ],
+}
+luts = {}
+
+
+def gradient_lut(name):
+    """Returns the lookup table of a gradient, gray if the gradient is unknown.
+
+    Args:
+        name (str): Name of the gradient, e.g. 'Gold'.
+
+    Returns:
+        lut (np-array): uint8 array with the shape (256, 3).
+    """
+
+    name = name.lower() if name and name.lower() in gradients else "gray"
+    if name not in luts:
+        stops = np.array(gradients[name])
+        pos = np.linspace(0.0, 1.0, 256)
+        channels = [np.interp(pos, stops[:, 0], stops[:, i]) for i in (1, 2, 3)]
+        luts[name] = np.round(255 * np.column_stack(channels)).astype(np.uint8)
+
+    return luts[name]
+
+
+def color_range(z, range_type, fixed=None):
+    """Returns the data values mapped to the first and the last color.
+
+    Args:
+        z (np-array): Data.
+        range_type (int): 0 full, 1 fixed, 2 auto, see Gwyddion.
+        fixed (tuple): Minimum and maximum for the fixed range.
+    """
+
+    if range_type == range_fixed and fixed is not None:
+        return fixed
+    if range_type == range_auto:
+        return tuple(np.percentile(z, [auto_cut, 100 - auto_cut]))
+
+    return z.min(), z.max()
+
+
+def color_scale(z, range_type=range_full, fixed=None):
+    """Returns the mapping of data values to the color positions 0 ... 1.
+
+    The mapping is computed from the full data, so it can be applied to
+    downsampled versions of the data as well.
+
+    Args:
+        z (np-array): Data.
+        range_type (int): 0 full, 1 fixed, 2 auto, 3 adaptive, see Gwyddion.
+        fixed (tuple): Minimum and maximum for the fixed range.
+
+    Returns:
+        scale (tuple): Data values and color positions for np.interp.
+    """
+
+    if range_type == range_adaptive:
+        # Histogram equalization, each color is used for the same number of pixels
+        positions = np.linspace(0.0, 1.0, 257)
+        return np.percentile(z, 100 * positions), positions
+
+    low, high = color_range(z, range_type, fixed)
+    if not high > low:
+        return [low], [0.0]
+
+    return [low, high], [0.0, 1.0]
+
+
+def color_index(z, range_type=range_full, fixed=None, scale=None):
+    """Maps data values to the indices 0 ... 255 of a lookup table.
+
+    Args:
+        z (np-array): Data.
+        range_type (int): 0 full, 1 fixed, 2 auto, 3 adaptive, see Gwyddion.
+        fixed (tuple): Minimum and maximum for the fixed range.
+        scale (tuple): Precomputed color scale, see color_scale.
+    """
+
+    if scale is None:
+        scale = color_scale(z, range_type, fixed)
+    scaled = np.interp(z, scale[0], scale[1])
+
+    return np.clip(scaled * 256, 0, 255).astype(np.uint8)
+
+
+def render(z, range_type=range_full, gradient="gray", fixed=None, scale=None):
+    """Renders data to an RGB image.
+
+    Args:
+        z (np-array): Data with the shape (rows, columns).
+        range_type (int): 0 full, 1 fixed, 2 auto, 3 adaptive, see Gwyddion.
+        gradient (str): Name of the gradient.
+        fixed (tuple): Minimum and maximum for the fixed range.
+        scale (tuple): Precomputed color scale, see color_scale.
+
+    Returns:
+        rgb (np-array): uint8 array with the shape (rows, columns, 3).
+    """
+
+    return gradient_lut(gradient)[color_index(z, range_type, fixed, scale)]
+
+
+def downsample(z, factor):
+    """Reduces the resolution by averaging blocks of factor x factor pixels.
+
+    Incomplete blocks at the borders are averaged as well.
+
+    Args:
+        z (np-array): Data with the shape (rows, columns).
+        factor (int): Edge length of the blocks.
+    """
+
+    if factor <= 1:
+        return z
+
+    rows, cols = z.shape
+    pad_rows, pad_cols = -rows % factor, -cols % factor
+    if pad_rows or pad_cols:
+        z = np.pad(z, ((0, pad_rows), (0, pad_cols)), mode="edge")
+
+    blocks = z.reshape(z.shape[0] // factor, factor, z.shape[1] // factor, factor)
+    return blocks.mean(axis=(1, 3))
+
+
+def png_chunk(tag, content):
+    """Returns a PNG chunk with length and checksum."""
+
+    return (
+        struct.pack(">I", len(content))
+        + tag
+        + content
+        + struct.pack(">I", zlib.crc32(tag + content) & 0xFFFFFFFF)
+    )
+
+
+def encode_png(rgb, level=6):
+    """Encodes an RGB image as PNG.
+
+    Args:
+        rgb (np-array): uint8 array with the shape (rows, columns, 3).
+        level (int): zlib compression level.
+
+    Returns:
+        png (bytes): Content of the PNG file.
+    """
+
+    rows, cols = rgb.shape[:2]
+    # Each scanline starts with the filter type 0 (none)
+    lines = np.zeros((rows, 3 * cols + 1), dtype=np.uint8)
+    lines[:, 1:] = rgb.reshape(rows, 3 * cols)
+    header = struct.pack(">IIBBBBB", cols, rows, 8, 2, 0, 0, 0)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + png_chunk(b"IHDR", header)
+        + png_chunk(b"IDAT", zlib.compress(lines.tobytes(), level))
+        + png_chunk(b"IEND", b"")
+    )
+
+
+def save_png(
+    z, png_file, range_type=range_full, gradient="gray", fixed=None, scale=None
+):
+    """Renders data and saves it as PNG file.
+
+    Args:
+        z (np-array): Data with the shape (rows, columns).
+        png_file (str): Path of the PNG file.
+        range_type (int): 0 full, 1 fixed, 2 auto, 3 adaptive, see Gwyddion.
+        gradient (str): Name of the gradient.
+        fixed (tuple): Minimum and maximum for the fixed range.
+        scale (tuple): Precomputed color scale, see color_scale.
+    """
+
+    with open(png_file, "wb") as f:
+        f.write(encode_png(render(z, range_type, gradient, fixed, scale)))
+
+
+def thumb_file(png_file):
+    """Returns the path of the thumbnail of an image, e.g. '271_tf_thumb.png'."""
+
+    return os.path.splitext(png_file)[0] + "_thumb.png"
+
+
+def save_thumbnail(z, png_file, size, gradient="gray", scale=None):
+    """Saves a downsampled image next to the full image.
+
+    Args:
+        z (np-array): Data with the shape (rows, columns).
+        png_file (str): Path of the full image.
+        size (int): Maximum edge length of the thumbnail in pixels.
+        gradient (str): Name of the gradient.
+        scale (tuple): Color scale of the full image, see color_scale.
+    """
+
+    factor = -(-max(z.shape) // size)
+    z_thumb = downsample(z, factor)
+    save_png(z_thumb, thumb_file(png_file), gradient=gradient, scale=scale)
+
+
+def save_tiles(z, png_file, gradient="gray", scale=None):
+    """Saves a pyramid of image tiles next to the full image.
+
+    Level 0 has the full resolution, each following level half of the
+    resolution of the previous one, until the image fits into one tile.
+    The tiles are named e.g. '271_tf_z1_0_2.png' (level 1, row 0, column 2).
+
+    Args:
+        z (np-array): Data with the shape (rows, columns).
+        png_file (str): Path of the full image.
+        gradient (str): Name of the gradient.
+        scale (tuple): Color scale of the full image, see color_scale.
+
+    Returns:
+        levels (int): Number of levels.
+    """
+
+    base = os.path.splitext(png_file)[0]
+    level = 0
+    while True:
+        z_level = downsample(z, 2**level)
+        rows, cols = z_level.shape
+        for row in range(0, rows, tile_size):
+            for col in range(0, cols, tile_size):
+                tile = z_level[row : row + tile_size, col : col + tile_size]
+                tile_file = "{0}_z{1}_{2}_{3}.png".format(
+                    base, level, row // tile_size, col // tile_size
+                )
+                save_png(tile, tile_file, gradient=gradient, scale=scale)
+        level += 1
+        if max(rows, cols) <= tile_size:
+            return level
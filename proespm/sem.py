@@ -32,6 +32,10 @@ class Sem(Data):
         **kwargs (str): optional arguments like e.g. surface, remark
     """
 
+    volatile = Data.volatile + ("container",)
+    exports = ("img",)
+    heavy = Data.heavy + ("container",)
+
     def __init__(self, m_file, **kwargs):
         self.surface = None
         Data.__init__(self, m_file, **kwargs)
@@ -73,4 +77,4 @@ class Sem(Data):
         self.img = os.path.join(path, str(self.m_id) + "." + config.img_type_out)
         self.match_ch_topo = "/" + str(self.channel_id) + "/base/range-type"
         self.container[self.match_ch_topo] = 2
-        gwyddion.save_image_file(self.container, self.img)
+        gwyddion.save_image_file(self.container, self.img, self.channel_id)
@@ -20,6 +20,8 @@ class Spectroscopy(Data):
 class Raman(Spectroscopy):
     """Raman measurements."""
 
+    heavy = Spectroscopy.heavy + ("wavelength", "intensity")
+
     def __init__(self, m_file, **kwargs):
         Spectroscopy.__init__(self, m_file, **kwargs)
         self.wavelength = None
@@ -54,6 +56,8 @@ class Raman(Spectroscopy):
 class Xps(Spectroscopy):
     """X-ray photon electron spectroscopy measurements."""
 
+    heavy = Spectroscopy.heavy + ("e_kin", "intensity")
+
     def __init__(self, m_file, **kwargs):
         Spectroscopy.__init__(self, m_file, **kwargs)
         self.xray = None
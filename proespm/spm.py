@@ -8,11 +8,13 @@ See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
 import shutil
 import re
 import os
+import fnmatch
 import numpy as np
 import config
 import gwyddion
+import topo
 from data import Data
-from ec import Ec
+from ec import Ec, decimate
 from util import import_helper, win32_helper
 
 import_helper()
@@ -22,7 +24,6 @@ if "path_gwyddion" not in locals():
 
 # pylint: disable=wrong-import-position
 import gwy
-import gwyutils
 
 # pylint: enable=wrong-import-position
 
@@ -37,6 +38,10 @@ class Spm(Data):
         file (str): Path to ecstm file.
     """
 
+    volatile = Data.volatile + ("container", "settings", "arrays")
+    heavy = Data.heavy + ("container", "arrays")
+    exports = ("img_topo_fwd", "img_topo_bwd")
+
     def __init__(self, m_file, **kwargs):
         self.surface = None
         self.tip = None
@@ -44,6 +49,8 @@ class Spm(Data):
         self.set_settings()
         self.container = gwy.gwy_file_load(self.m_file, gwy.RUN_NONINTERACTIVE)
         gwy.gwy_app_data_browser_add(self.container)
+        self.current_ch = None
+        self.index_channels()
         self.img_topo_fwd = None
         self.img_topo_bwd = None
         self.topo_fwd_ch = self.return_topo_fwd_ch()
@@ -119,31 +126,58 @@ class Spm(Data):
         self.settings["/module/scale/aspectratio"] = config.aspectratio
         self.settings["/module/asciiexport/add-comment"] = config.add_comment
 
+    def index_channels(self):
+        """Reads the titles of all data channels of the container once.
+
+        All channel lookups use these tables instead of querying the
+        Gwyddion data browser again. Converted channels are stored in
+        self.arrays, see convert_np.
+        """
+
+        self.ch = gwy.gwy_app_data_browser_get_data_ids(self.container)
+        self.ch_titles = {}
+        self.title_ids = {}
+        for i in self.ch:
+            title = self.container["/" + str(i) + "/data/title"]
+            self.ch_titles[i] = title
+            self.title_ids.setdefault(title, []).append(i)
+        self.matches = {}
+        self.arrays = {}
+
     def find_channel(self, match_list):
         """Finds the right data channel within a Gwyddion container.
 
         Args:
-            container: Gwyddion container with several data channels.
-            match_list (list): Names which will be searched. e.g. topography
+            match_list (list): Title patterns which will be searched, e.g. '*Utun*'.
 
         Returns:
             chn_ids (list): List of channel IDs.
         """
 
-        self.ch_ids = []
-        for self._data_title in match_list:
-            self._match_ch = gwy.gwy_app_data_browser_find_data_by_title(
-                self.container, self._data_title
-            )
-            self.ch_ids.extend(self._match_ch)
+        key = tuple(match_list)
+        if key not in self.matches:
+            self.matches[key] = [
+                i
+                for pat in match_list
+                for i in self.ch
+                if fnmatch.fnmatchcase(self.ch_titles[i], pat)
+            ]
 
-        return self.ch_ids
+        return list(self.matches[key])
 
     def return_data_ch_titles(self):
         """Returns data channel titel"""
 
-        self.ch = gwy.gwy_app_data_browser_get_data_ids(self.container)
-        return [self.container["/" + str(i) + "/data/title"] for i in self.ch]
+        return [self.ch_titles[i] for i in self.ch]
+
+    def return_data_ch_title(self, channel_id):
+        """Returns the title of a data channel.
+
+        Args:
+            channel_id (int): ID of the channel.
+        """
+
+        return self.ch_titles[channel_id]
 
     def return_match_ch(self, pattern, channels):
         """Returns topography channels
@@ -161,10 +195,7 @@ class Spm(Data):
             if len(self.topo_ch) > 0:
                 break
 
-        return [
-            gwy.gwy_app_data_browser_find_data_by_title(self.container, ch)
-            for ch in self.topo_ch
-        ]
+        return [list(self.title_ids[ch]) for ch in self.topo_ch]
 
     def return_topo_fwd_ch(self):
         """Returns tophography forward channel"""
@@ -223,9 +254,23 @@ class Spm(Data):
 
         return self.name
 
+    def select_channel(self, channel_id):
+        """Makes a data field (channel) current/active in the data browser.
+
+        The current channel is exported by save_image_file.
+
+        Args:
+            channel_id (int): ID of the channel.
+        """
+
+        gwy.gwy_app_data_browser_select_data_field(self.container, channel_id)
+        self.current_ch = channel_id
+
     def convert_np(self, channel_id):
         """Converts a Gwyddion container to a Numpy array.
 
+        Each channel is converted only once, until it is processed.
+
         Args:
             channel_id (int): ID of channel which will be converted.
 
@@ -233,12 +278,13 @@ class Spm(Data):
             np_array (array): Numpy array of container channel.
         """
 
-        # Makes a data field (channel) current/active in the data browser.
-        gwy.gwy_app_data_browser_select_data_field(self.container, channel_id)
-        self.key = gwy.gwy_app_get_data_key_for_id(channel_id)
-        self.name = gwy.gwy_name_from_key(self.key)
+        self.select_channel(channel_id)
+        if channel_id not in self.arrays:
+            self.key = gwy.gwy_app_get_data_key_for_id(channel_id)
+            self.name = gwy.gwy_name_from_key(self.key)
+            self.arrays[channel_id] = gwyddion.field_array(self.container[self.name])
 
-        return gwyutils.data_field_data_as_array(self.container[self.name])
+        return self.arrays[channel_id]
 
     def process_topo(self, data_ch_id):
         """Processes the data with Gwyddion Python module.
@@ -252,16 +298,39 @@ class Spm(Data):
             data_ch_id (int): Channel of the container should be processed.
         """
         for ch in data_ch_id:
-            gwy.gwy_app_data_browser_select_data_field(self.container, ch)
-
-            self.run_gwy_func = {gwy.RUN_IMMEDIATE: config.run_gwy_immediate_func}
-            for k, funcs in self.run_gwy_func.iteritems():
-                for func in funcs:
-                    gwy.gwy_process_func_run(func, self.container, k)
+            self.select_channel(ch)
+            self.arrays.pop(ch, None)
+
+            if config.spm_engine == "numpy" and topo.is_supported(
+                config.run_gwy_immediate_func
+            ):
+                self.process_topo_np(ch)
+            else:
+                self.run_gwy_func = {gwy.RUN_IMMEDIATE: config.run_gwy_immediate_func}
+                for k, funcs in self.run_gwy_func.iteritems():
+                    for func in funcs:
+                        gwy.gwy_process_func_run(func, self.container, k)
 
             self.match_ch_topo = "/" + str(ch) + "/base/range-type"
             self.container[self.match_ch_topo] = 2
 
+    def process_topo_np(self, channel_id):
+        """Processes a channel with the NumPy engine, see topo.py.
+
+        Args:
+            channel_id (int): Channel of the container which will be processed.
+        """
+
+        self.key = gwy.gwy_app_get_data_key_for_id(channel_id)
+        self.name = gwy.gwy_name_from_key(self.key)
+        field = self.container[self.name]
+        z_data = topo.process(
+            gwyddion.field_array(field),
+            config.run_gwy_immediate_func,
+            gwyddion.field_mask(self.container, channel_id),
+        )
+        gwyddion.set_field_data(field, z_data)
+
     def process_topo_fwd(self):
         """Process forward topography"""
 
@@ -285,7 +354,7 @@ class Spm(Data):
         self.img_topo_fwd = os.path.join(
             path, str(self.m_id) + "_tf." + config.img_type_out
         )
-        gwyddion.save_image_file(self.container, self.img_topo_fwd)
+        gwyddion.save_image_file(self.container, self.img_topo_fwd, self.current_ch)
 
     def save_topo_bwd_image(self, path):
         """Save backward topography image file.
@@ -297,7 +366,7 @@ class Spm(Data):
         self.img_topo_bwd = os.path.join(
             path, str(self.m_id) + "_tb." + config.img_type_out
         )
-        gwyddion.save_image_file(self.container, self.img_topo_bwd)
+        gwyddion.save_image_file(self.container, self.img_topo_bwd, self.current_ch)
 
     def save_topo_fwd_data(self, path):
         """Save forward topography data file.
@@ -336,9 +405,8 @@ class Spm(Data):
 
         self.key = gwy.gwy_app_get_data_key_for_id(0)
         self.name = gwy.gwy_name_from_key(self.key)
-        self.data_tmp = gwyutils.data_field_data_as_array(self.container[self.name])
 
-        return np.shape(self.data_tmp)
+        return gwyddion.field_shape(self.container[self.name])
 
     def flush_memory(self):
         """Deletes all the data channels in a Gwyddion container.
@@ -347,6 +415,7 @@ class Spm(Data):
         error will occur.
         """
 
+        self.arrays = {}
         for data_ch_id in gwy.gwy_app_data_browser_get_data_ids(self.container):
             self.key = gwy.gwy_app_get_data_key_for_id(data_ch_id)
             self.container.remove(self.key)
@@ -356,10 +425,13 @@ class Stm(Spm):
     """Represents any stm data. Compared to spm data it also stores
     tunnel current and tunnel voltage"""
 
+    heavy = Spm.heavy + ("u_tun_data",)
+
     def __init__(self, m_file, **kwargs):
         Spm.__init__(self, m_file, **kwargs)
         self.i_tun = self.return_i_tun_mean()
         self.u_tun = self.return_u_tun_mean()
+        self.u_tun_data = None
 
     def u_tun_line(self):
         """Returns the average tunnel voltage value for each stm line.
@@ -371,14 +443,14 @@ class Stm(Spm):
 
         self._utun_ch_ids = Spm.find_channel(self, ["*Utun*"])
         if len(self._utun_ch_ids) != 0:
-            self.u_tun_array = self.convert_np(self._utun_ch_ids[0])
-            return np.average(self.u_tun_array, axis=0)
+            return np.average(self.convert_np(self._utun_ch_ids[0]), axis=0)
 
     def return_u_tun_mean(self):
         """Returns the average tunnel voltage of one stm image."""
 
-        if self.u_tun_line() is not None:
-            return np.mean(self.u_tun_line())
+        u_tun_line = self.u_tun_line()
+        if u_tun_line is not None:
+            return np.mean(u_tun_line)
         else:
             self.meta_id = gwyddion.get_meta_ids(self.container)[0]
             try:
@@ -393,7 +465,8 @@ class Stm(Spm):
         self.dat_utun_file = os.path.join(
             path, str(self.m_id) + "_utun." + config.dat_type_out
         )
-        np.savetxt(self.dat_utun_file, Stm.u_tun_line(self), delimiter=";")
+        self.u_tun_data = Stm.u_tun_line(self)
+        np.savetxt(self.dat_utun_file, self.u_tun_data, delimiter=";")
 
         if config.dat_type_igor:
             self.file_utun_igor = os.path.join(path, "g" + str(self.m_id) + "_ori.ut0")
@@ -423,6 +496,9 @@ class Stm(Spm):
 class Ecstm(Stm, Ec):
     """Ecstm measurement data."""
 
+    exports = Stm.exports + ("file_ec_igor", "file_ic_igor", "file_utun_igor")
+    heavy = Stm.heavy + ("ecell", "icell")
+
     def __init__(self, m_file, **kwargs):
         Stm.__init__(self, m_file, **kwargs)
         Ec.__init__(self, m_file, **kwargs)
@@ -451,8 +527,7 @@ class Ecstm(Stm, Ec):
         """
 
         if len(self._ecell_ch_id) != 0:
-            self.e_cell_data = self.convert_np(self._ecell_ch_id[0])
-            return np.average(self.e_cell_data, axis=0).tolist()
+            return np.average(self.convert_np(self._ecell_ch_id[0]), axis=0)
         else:
             return None
 
@@ -465,8 +540,7 @@ class Ecstm(Stm, Ec):
         """
 
         if len(self._icell_ch_id) != 0:
-            self.i_cell_data = self.convert_np(self._icell_ch_id[0])
-            return np.average(self.i_cell_data, axis=0).tolist()
+            return np.average(self.convert_np(self._icell_ch_id[0]), axis=0)
         else:
             return None
 
@@ -476,7 +550,8 @@ class Ecstm(Stm, Ec):
         self.ec_data_file = os.path.join(
             path, str(self.m_id) + "_ec" + "." + config.dat_type_out
         )
-        np.savetxt(self.ec_data_file, self.return_e_cell_data(), delimiter=";")
+        self.ecell = self.return_e_cell_data()
+        np.savetxt(self.ec_data_file, self.ecell, delimiter=";")
 
         if config.dat_type_igor:
             self.file_ec_igor = os.path.join(path, "g" + str(self.m_id) + "_ori.ec0")
@@ -494,10 +569,31 @@ class Ecstm(Stm, Ec):
             self.file_ic_igor = os.path.join(path, "g" + str(self.m_id) + "_ori.ic0")
             shutil.move(self.ic_data_file, self.file_ic_igor)
 
+    def plot_data(self):
+        """Returns the line data reduced to config.max_plot_points for plotting.
+
+        Returns:
+            traces (dict): Line numbers and values of 'ecell', 'utun' and 'icell'.
+        """
+
+        traces = {}
+        for name, values in [
+            ("ecell", self.ecell),
+            ("utun", self.u_tun_data),
+            ("icell", self.icell),
+        ]:
+            values = np.asarray(values, dtype=float)
+            index = decimate(values, config.max_plot_points)
+            traces[name] = (index, values[index])
+
+        return traces
+
 
 class Afm(Spm):
     """Atomic force mircoscopy."""
 
+    exports = Spm.exports + ("img_phase_fwd", "img_phase_bwd")
+
     def __init__(self, m_file, **kwargs):
         Spm.__init__(self, m_file, **kwargs)
 
@@ -519,7 +615,7 @@ class Afm(Spm):
         """Return backward phase channel."""
 
         self.pat_bwd = [r"^.*[B||b]ackward.*$", r"^.*[L||l]eft.*$", r".*bwd.*"]
-        for ch in self.returnPhaseCh():
+        for ch in self.return_phase_ch():
             for pat in self.pat_bwd:
                 if re.match(pat, self.return_data_ch_title(ch)):
                     return ch
@@ -527,21 +623,17 @@ class Afm(Spm):
     def save_phase_fwd_image(self, path):
         """Save forward phase to image file."""
 
-        gwy.gwy_app_data_browser_select_data_field(
-            self.container, self.return_phase_fwd_ch()
-        )
+        self.select_channel(self.return_phase_fwd_ch())
         self.img_phase_fwd = os.path.join(
             path, str(self.m_id) + "_pf." + config.img_type_out
         )
-        gwyddion.save_image_file(self.container, self.img_phase_fwd)
+        gwyddion.save_image_file(self.container, self.img_phase_fwd, self.current_ch)
 
     def save_phase_bwd_image(self, path):
         """Save backward phase to image file."""
 
-        gwy.gwy_app_data_browser_select_data_field(
-            self.container, self.return_phase_bwd_ch()
-        )
+        self.select_channel(self.return_phase_bwd_ch())
         self.img_phase_bwd = os.path.join(
             path, str(self.m_id) + "_pb." + config.img_type_out
         )
-        gwyddion.save_image_file(self.container, self.img_phase_bwd)
+        gwyddion.save_image_file(self.container, self.img_phase_bwd, self.current_ch)
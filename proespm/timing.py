@@ -0,0 +1,251 @@
+"""timing.py
+
+Part of proespm: Time and memory profile of the processing.
+
+The stages of each file (load, process, save image, save data, flush,
+report) are measured by a Timer, which is passed with the item from the
+worker processes. The Profile of a run collects the timers and writes them
+next to the processing log.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import heapq
+import marshal
+import cProfile
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+
+# Folder of the profile, folders starting with '_' are not searched for files
+profile_dir = "_profile"
+# Profile of the current run, None: the processing is not profiled
+current = None
+
+
+def cpu_time():
+    """Returns the user and system CPU time of this process in seconds."""
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+def peak_rss():
+    """Returns the peak resident memory of this process in MB, None if unknown."""
+
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB on Linux
+    return rss / 2.0**20 if sys.platform == "darwin" else rss / 2.0**10
+
+
+class Timer(object):
+    """Measures the stages of one file.
+
+    Stages with the same name, e.g. the forward and backward images, are
+    added up. The peak memory is only known for the whole process, so it is
+    recorded once per file, after the file was processed.
+
+    Args:
+        detailed (bool): True: record cProfile statistics of all stages.
+    """
+
+    def __init__(self, detailed=False):
+        self.stages = {}
+        self.stats = None
+        self.rss = None
+        self.profiler = cProfile.Profile() if detailed else None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measures the code of the with block as stage."""
+
+        if self.profiler is not None:
+            self.profiler.enable()
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+            record = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            record["wall"] += time.time() - wall
+            record["cpu"] += cpu_time() - cpu
+
+    def finish(self):
+        """Stores the peak memory and the cProfile statistics.
+
+        The timer can be pickled afterwards. Stages measured afterwards, e.g.
+        the report, are not in the statistics.
+        """
+
+        self.rss = peak_rss()
+        if self.profiler is not None:
+            self.profiler.create_stats()
+            self.stats = marshal.dumps(self.profiler.stats)
+            self.profiler = None
+
+    def wall(self):
+        """Returns the wall time of all stages."""
+
+        return sum(x["wall"] for x in self.stages.values())
+
+
+@contextlib.contextmanager
+def no_stage():
+    """Used instead of a stage of an item which is not profiled."""
+
+    yield
+
+
+def stage(item, name):
+    """Returns the context which measures a stage of an item of the current run.
+
+    Args:
+        item (Data): Measurement item.
+        name (str): Name of the stage, e.g. 'report'.
+    """
+
+    if current is None or id(item) not in current.timers:
+        return no_stage()
+
+    return current.timers[id(item)].stage(name)
+
+
+class Profile(object):
+    """Collects the timers of the files of one run.
+
+    Args:
+        slowest (int): Number of files whose cProfile statistics are written.
+    """
+
+    def __init__(self, slowest=0):
+        self.slowest = slowest
+        self.timers = {}
+        self.files = []
+        self.detailed = []
+        self.start = time.time(), cpu_time()
+
+    def track(self, item):
+        """Takes the timer from a processed item, until the item is finished."""
+
+        timer = item.__dict__.pop("timer", None)
+        if timer is None:
+            # Items from the manifest, the ID may be one of a finished item
+            self.timers.pop(id(item), None)
+        else:
+            self.timers[id(item)] = timer
+
+    def finish(self, item):
+        """Records the stages of an item which is not used anymore."""
+
+        timer = self.timers.pop(id(item), None)
+        if timer is None:
+            return
+
+        self.files.append(
+            {
+                "file": os.path.basename(item.m_file),
+                "class": type(item).__name__,
+                "wall": timer.wall(),
+                "rss": timer.rss,
+                "stages": timer.stages,
+            }
+        )
+        if timer.stats is not None and self.slowest:
+            # The statistics of the slowest files are kept in a min heap
+            entry = (timer.wall(), len(self.files), str(item.m_id), timer.stats)
+            if len(self.detailed) < self.slowest:
+                heapq.heappush(self.detailed, entry)
+            else:
+                heapq.heappushpop(self.detailed, entry)
+
+    def classes(self):
+        """Returns the stages added up per measurement class.
+
+        The peak memory of a class is the highest process peak of its files.
+        """
+
+        classes = {}
+        for row in self.files:
+            cls = classes.setdefault(
+                row["class"], {"files": 0, "wall": 0.0, "rss": None, "stages": {}}
+            )
+            cls["files"] += 1
+            cls["wall"] += row["wall"]
+            if row["rss"] is not None:
+                cls["rss"] = max(cls["rss"] or 0.0, row["rss"])
+            for name, record in row["stages"].items():
+                total = cls["stages"].setdefault(name, {"wall": 0.0, "cpu": 0.0})
+                total["wall"] += record["wall"]
+                total["cpu"] += record["cpu"]
+
+        return classes
+
+    def write(self, directory):
+        """Writes the profile as JSON and CSV file and the cProfile statistics.
+
+        The files are written to the _profile folder, as the CSV file would
+        be taken for a measurement otherwise. The statistics can be read with
+        pstats, e.g. pstats.Stats('_profile/271.prof').
+
+        Args:
+            directory (str): Folder of the processing log.
+
+        Returns:
+            paths (list): Paths of the written files.
+        """
+
+        folder = os.path.join(directory, profile_dir)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        summary = {
+            "wall": time.time() - self.start[0],
+            "cpu": cpu_time() - self.start[1],
+            "rss": peak_rss(),
+            "classes": self.classes(),
+            "files": self.files,
+        }
+        paths = [os.path.join(folder, "profile.json")]
+        with open(paths[-1], "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+        paths.append(os.path.join(folder, "profile.csv"))
+        with open(paths[-1], "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ["file", "class", "stage", "wall", "cpu", "process peak rss"]
+            )
+            for row in self.files:
+                for name in sorted(row["stages"]):
+                    record = row["stages"][name]
+                    writer.writerow(
+                        [
+                            row["file"],
+                            row["class"],
+                            name,
+                            record["wall"],
+                            record["cpu"],
+                            row["rss"],
+                        ]
+                    )
+
+        for _, _, m_id, stats in sorted(self.detailed, reverse=True):
+            paths.append(os.path.join(folder, m_id + ".prof"))
+            with open(paths[-1], "wb") as f:
+                f.write(stats)
+
+        return paths
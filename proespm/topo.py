@@ -0,0 +1,242 @@
+"""topo.py
+
+Part of proespm: NumPy processing of SPM topography data.
+
+The functions work on plain arrays with the shape (rows, columns), so they
+can be used without the Gwyddion data browser, e.g. in worker processes.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import config
+
+
+# Gwyddion linematch methods
+align_poly = 0
+align_median = 1
+align_median_diff = 2
+
+# Gwyddion masking modes
+mask_exclude = 0
+mask_include = 1
+mask_ignore = 2
+
+
+def fit_weights(mask, masking):
+    """Returns the pixels used for a fit, or None if all pixels are used.
+
+    Args:
+        mask (np-array): Bool array, True where the data is masked.
+        masking (int): Gwyddion masking mode.
+    """
+
+    if mask is None or masking == mask_ignore:
+        return None
+    if masking == mask_exclude:
+        return ~mask
+
+    return mask
+
+
+def plane_level(z):
+    """Subtracts the least squares plane from the data.
+
+    On a full grid the centered x and y coordinates are orthogonal, so the
+    slopes follow from the column and row sums without a design matrix.
+
+    Args:
+        z (np-array): Topography.
+
+    Returns:
+        z (np-array): Leveled topography with zero mean.
+    """
+
+    rows, cols = z.shape
+    x = np.arange(cols) - (cols - 1) / 2.0
+    y = np.arange(rows) - (rows - 1) / 2.0
+    slope_x = np.dot(z.sum(axis=0), x) / (rows * np.dot(x, x)) if cols > 1 else 0.0
+    slope_y = np.dot(z.sum(axis=1), y) / (cols * np.dot(y, y)) if rows > 1 else 0.0
+
+    leveled = z - z.mean()
+    leveled -= slope_x * x[np.newaxis, :]
+    leveled -= slope_y * y[:, np.newaxis]
+
+    return leveled
+
+
+def row_polynomials(z, max_degree, weights=None):
+    """Returns the least squares polynomial of each row.
+
+    Rows with less usable pixels than coefficients are not fitted.
+
+    Args:
+        z (np-array): Topography.
+        max_degree (int): Degree of the polynomials.
+        weights (np-array): Bool array of the usable pixels, None: all pixels.
+    """
+
+    cols = z.shape[1]
+    x = np.linspace(-1.0, 1.0, cols)
+    vander = np.vander(x, max_degree + 1)
+    if weights is None:
+        coeffs = np.dot(np.linalg.pinv(vander), z.T)
+        return np.dot(vander, coeffs).T
+
+    background = np.zeros(z.shape)
+    for i, row in enumerate(z):
+        usable = weights[i]
+        if usable.sum() > max_degree:
+            coeffs = np.linalg.lstsq(vander[usable], row[usable], rcond=None)[0]
+            background[i] = np.dot(vander, coeffs)
+
+    return background
+
+
+def row_medians(z, weights=None):
+    """Returns the median of each row, NaN for rows without usable pixels."""
+
+    if weights is None:
+        return np.median(z, axis=1)
+
+    return np.array(
+        [
+            np.median(row[usable]) if usable.any() else np.nan
+            for row, usable in zip(z, weights)
+        ]
+    )
+
+
+def align_rows(z, max_degree=0, method=align_poly, masking=mask_ignore, mask=None):
+    """Aligns the rows of the data, like the Gwyddion linematch module.
+
+    The row background is subtracted and its mean is added again, so the
+    average height of the data is kept.
+
+    Args:
+        z (np-array): Topography.
+        max_degree (int): Degree of the row polynomials (method 0).
+        method (int): 0 polynomial, 1 median, 2 median of differences.
+        masking (int): 0 exclude, 1 include, 2 ignore the mask.
+        mask (np-array): Bool array, True where the data is masked.
+
+    Returns:
+        z (np-array): Topography with aligned rows.
+    """
+
+    weights = fit_weights(mask, masking)
+    if method == align_poly:
+        background = row_polynomials(z, max_degree, weights)
+    elif method == align_median:
+        background = row_medians(z, weights)[:, np.newaxis]
+    elif method == align_median_diff:
+        diff = z[1:] - z[:-1]
+        if weights is not None:
+            weights = weights[1:] & weights[:-1]
+        steps = np.concatenate([[0.0], row_medians(diff, weights)])
+        background = np.cumsum(np.nan_to_num(steps))[:, np.newaxis]
+    else:
+        raise ValueError("Align rows method " + str(method) + " is not supported")
+
+    background = np.nan_to_num(background)
+
+    return z - background + background.mean()
+
+
+def median_filter(z, radius, max_elements=2**22):
+    """Median filter with a circular kernel.
+
+    The data is processed in blocks of rows, so the memory needed is
+    limited to about max_elements values. The borders are mirrored.
+
+    Args:
+        z (np-array): Topography.
+        radius (int): Radius of the kernel in pixels.
+        max_elements (int): Maximum number of values per block.
+    """
+
+    r = int(radius)
+    yy, xx = np.mgrid[-r : r + 1, -r : r + 1]
+    kernel = xx**2 + yy**2 <= r**2
+    rows, cols = z.shape
+    padded = np.pad(z, r, mode="symmetric")
+    windows = as_strided(
+        padded,
+        shape=(rows, cols, 2 * r + 1, 2 * r + 1),
+        strides=padded.strides * 2,
+        writeable=False,
+    )
+
+    block = max(1, max_elements // (cols * kernel.sum()))
+    filtered = np.empty(z.shape)
+    for start in range(0, rows, block):
+        stop = min(start + block, rows)
+        filtered[start:stop] = np.median(windows[start:stop][:, :, kernel], axis=-1)
+
+    return filtered
+
+
+def median_background(z, radius):
+    """Subtracts the median filtered data from the data.
+
+    Args:
+        z (np-array): Topography.
+        radius (int): Radius of the kernel in pixels.
+    """
+
+    return z - median_filter(z, radius)
+
+
+def fix_zero(z):
+    """Shifts the data, so the minimum is zero."""
+
+    return z - z.min()
+
+
+def is_supported(funcs, method=None):
+    """Checks if the functions can be run with the NumPy engine.
+
+    Args:
+        funcs (list): Gwyddion function names, e.g. ['level', 'fix_zero'].
+        method (int): Align rows method, default from the config file.
+    """
+
+    method = config.method if method is None else method
+
+    return all(func in functions for func in funcs) and (
+        "align_rows" not in funcs
+        or method in [align_poly, align_median, align_median_diff]
+    )
+
+
+def process(z, funcs, mask=None):
+    """Runs Gwyddion processing functions on an array.
+
+    The parameters are taken from the config file.
+
+    Args:
+        z (np-array): Topography.
+        funcs (list): Gwyddion function names, e.g. ['level', 'fix_zero'].
+        mask (np-array): Bool array, True where the data is masked.
+
+    Returns:
+        z (np-array): Processed topography.
+    """
+
+    z = np.asarray(z, dtype=np.float64)
+    for func in funcs:
+        z = functions[func](z, mask)
+
+    return z
+
+
+functions = {
+    "level": lambda z, mask: plane_level(z),
+    "align_rows": lambda z, mask: align_rows(
+        z, config.max_degree, config.method, config.masking, mask
+    ),
+    "median_background": lambda z, mask: median_background(z, config.radius),
+    "fix_zero": lambda z, mask: fix_zero(z),
+}
@@ -11,6 +11,7 @@ import os
 import re
 import sys
 import shutil
+from multiprocessing.pool import ThreadPool
 import config
 
 
@@ -166,87 +167,117 @@ def query_yes_no(question, default="yes"):
             sys.stdout.write("Please respond with 'yes' or 'no' " "(or 'y' or 'n').\n")
 
 
-def multiple_move(source, destination, filetypes, hierarchy="", subfolder_name="sub"):
-    """Moves all files of a certain type to specified destination folder.
+def move_file(src_file, dest_dir):
+    """Moves a file into a folder, an existing file is overwritten.
+
+    Args:
+        src_file (str): Path to the file.
+        dest_dir (str): Path to the destination folder.
+    """
+
+    shutil.move(src_file, os.path.join(dest_dir, os.path.basename(src_file)))
 
-    It can optionaly take a hierarchy. You will be prompted and asked if you want
-    to overwrite files.
+
+class Publisher(object):
+    """Moves result files to their final destination in the background.
+
+    The files are moved by a pool of threads. Files of finished items can be
+    published while other files are still processed, the remaining files
+    are published at the end by listing the source folder once.
 
     Args:
-        source (str): Path to look for.
-        destination (str): Path to copy to.
-        filetypes (str): Which filetype should be moved e.g. ".png".
-        hierarchy (str): Can either be 'sub', 'parent' or not given.
-                         The subfolder will be created and named after
-                         the given filetype.
-        subfolder_name (str): Name of subfolder, default: sub.
+        source (str): Folder where the result files are created.
+        rules (list): Pairs of file endings and destination folder, e.g.
+                      (['png'], '/data/_png'). The first matching rule is used.
+        threads (int): Number of files moved at the same time.
     """
 
-    s = False
-    for filetype in filetypes:
-        list_dir = (x for x in os.listdir(source) if x.endswith(filetype))
-        if hierarchy == "sub":
-            sub_destination = os.path.join(destination, subfolder_name)
-            if not os.path.exists(sub_destination):
-                os.makedirs(sub_destination)
-
-            for item in list_dir:
-                try:
-                    shutil.move(os.path.join(source, item), sub_destination)
-                    s = True
-                except shutil.Error:
-                    if (
-                        s
-                        or config.force_override
-                        or query_yes_no(filetype + " already exist. Overwrite all?")
-                    ):
-                        shutil.move(
-                            os.path.join(source, item),
-                            os.path.join(sub_destination, os.path.basename(item)),
-                        )
-                        s = True
-                    else:
-                        s = False
-                        break
-
-        elif hierarchy == "parent":
-            parent_destination = os.path.split(destination)[0]
-
-            for item in list_dir:
-                try:
-                    shutil.move(os.path.join(source, item), parent_destination)
-                    s = True
-                except shutil.Error:
-                    if (
-                        s
-                        or config.force_override
-                        or query_yes_no(filetype + " already exist. Overwrite all?")
-                    ):
-                        dst_filename = os.path.join(
-                            parent_destination, os.path.basename(item)
-                        )
-                        shutil.move(os.path.join(source, item), dst_filename)
-                        s = True
-                    else:
-                        s = False
+    def __init__(self, source, rules, threads=4):
+        self.source = os.path.abspath(source)
+        self.rules = [(tuple(filetypes), dest) for filetypes, dest in rules]
+        self.pool = ThreadPool(processes=max(1, threads))
+        self.results = []
+        self.published = set()
+        self.existing = {}
+        self.overwrite = True if config.force_override else None
 
-        else:
-            for item in list_dir:
-                try:
-                    shutil.move(os.path.join(source, item), destination)
-                except shutil.Error:
-                    if (
-                        s
-                        or config.force_override
-                        or query_yes_no(filetype + " already exist. Overwrite all?")
-                    ):
-                        shutil.move(
-                            os.path.join(source, item),
-                            os.path.join(destination, os.path.basename(item)),
-                        )
-                        s = True
-                    else:
-                        s = False
-                        break
-
-    return s
+        for _, dest in self.rules:
+            if not os.path.exists(dest):
+                os.makedirs(dest)
+
+    def destination(self, name):
+        """Returns the destination folder of a file, None if it is not moved."""
+
+        for filetypes, dest in self.rules:
+            if name.endswith(filetypes):
+                return dest
+
+        return None
+
+    def may_overwrite(self, name, dest):
+        """Checks if a file can be moved to a destination folder.
+
+        The destination folders are listed once. You will be asked once if
+        existing files should be overwritten.
+        """
+
+        if dest not in self.existing:
+            self.existing[dest] = set(os.listdir(dest))
+        if name not in self.existing[dest]:
+            return True
+
+        if self.overwrite is None:
+            self.overwrite = query_yes_no("Files already exist. Overwrite all?")
+
+        return self.overwrite
+
+    def publish(self, files):
+        """Starts moving files of the source folder.
+
+        Files outside the source folder, files without destination and
+        files which were already published are ignored.
+
+        Args:
+            files (iterable): Paths to the files.
+        """
+
+        for f in files:
+            f = os.path.abspath(f)
+            name = os.path.basename(f)
+            dest = self.destination(name)
+            if (
+                dest is None
+                or f in self.published
+                or os.path.dirname(f) != self.source
+                or not os.path.isfile(f)
+                or not self.may_overwrite(name, dest)
+            ):
+                continue
+
+            self.published.add(f)
+            self.results.append(self.pool.apply_async(move_file, (f, dest)))
+
+    def publish_all(self):
+        """Starts moving all remaining files of the source folder."""
+
+        self.publish(os.path.join(self.source, x) for x in os.listdir(self.source))
+
+    def join(self):
+        """Blocks until all files are moved, errors of the moves are raised.
+
+        Returns:
+            moved (int): Number of moved files.
+        """
+
+        self.pool.close()
+        for result in self.results:
+            result.get()
+        self.pool.join()
+
+        return len(self.results)
+
+    def terminate(self):
+        """Stops the publishing, files which are being moved are finished."""
+
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,266 @@
+"""watch.py
+
+Part of proespm: Watching of source folders for new measurement files.
+
+On Linux, local folders are watched with inotify, otherwise the folders are
+polled. A new file is only processed once its size and mtime did not change
+for a while, as measurement programs write files over a longer time.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import prep
+
+
+# Linux inotify event masks, see inotify(7)
+in_close_write = 0x00000008
+in_moved_to = 0x00000080
+in_create = 0x00000100
+event_header = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """Waits for new files in directories with the Linux inotify API.
+
+    Raises:
+        OSError: If inotify is not available.
+    """
+
+    mask = in_close_write | in_moved_to | in_create
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or libc_name is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.watched = set()
+
+    def add(self, path):
+        """Watches a directory, directories which are watched already are ignored."""
+
+        if path in self.watched:
+            return
+
+        encoded = path
+        if not isinstance(path, bytes):
+            encoded = path.encode(sys.getfilesystemencoding())
+        if self.libc.inotify_add_watch(self.fd, encoded, self.mask) < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + path)
+        self.watched.add(path)
+
+    def wait(self, timeout):
+        """Blocks until a file is written or moved into a watched directory.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            bool: True if something changed, False after the timeout.
+        """
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+
+        # The events are only drained, the folders are scanned afterwards
+        events = os.read(self.fd, 2**16)
+        i = 0
+        while i < len(events):
+            length = event_header.unpack_from(events, i)[3]
+            i += event_header.size + length
+
+        return True
+
+    def close(self):
+        """Stops watching."""
+
+        os.close(self.fd)
+
+
+class Poller(object):
+    """Fallback of Inotify, which only waits for the timeout."""
+
+    def add(self, path):
+        """Nothing to do, the folders are scanned after each timeout."""
+
+    def wait(self, timeout):
+        """Sleeps for the timeout and returns True, so the folders are scanned."""
+
+        time.sleep(timeout)
+        return True
+
+    def close(self):
+        """Nothing to do."""
+
+
+def monitor(src_dirs):
+    """Returns an Inotify monitor for local folders, otherwise a Poller.
+
+    Network drives do not report changes made by other computers.
+
+    Args:
+        src_dirs (list): Source directories.
+    """
+
+    if any(prep.check_network_file(src_dir) for src_dir in src_dirs):
+        return Poller()
+
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return Poller()
+
+
+class Debouncer(object):
+    """Holds back files until their size and mtime did not change for a while.
+
+    Args:
+        settle (float): Time in seconds without changes.
+    """
+
+    def __init__(self, settle):
+        self.settle = settle
+        self.pending = {}
+
+    def add(self, files):
+        """Adds files which are not pending yet."""
+
+        for f in files:
+            self.pending.setdefault(f, (None, None))
+
+    def ready(self):
+        """Returns the pending files which did not change within the settle time.
+
+        Files which disappeared are dropped.
+        """
+
+        now = time.time()
+        ready = []
+        for f, (signature, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(f)
+            except OSError:
+                del self.pending[f]
+                continue
+
+            current = (stat.st_size, stat.st_mtime)
+            if current != signature:
+                self.pending[f] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[f]
+                ready.append(f)
+
+        return ready
+
+
+class Folder(object):
+    """Tracks the measurement files of a source directory.
+
+    The directory tree is scanned with the listing of the previous scan, so
+    only directories which changed are listed again.
+
+    Args:
+        src_dir (str): Source directory.
+        file_types (list): File endings, e.g. ['SM4', 'mpt'].
+        settle (float): Time in seconds a new file has to be unchanged.
+    """
+
+    def __init__(self, src_dir, file_types, settle):
+        self.src_dir = src_dir
+        self.suffixes = tuple(file_types)
+        self.listing = {}
+        self.files = []
+        self.processed = set()
+        self.ignored = set()
+        self.debouncer = Debouncer(settle)
+
+    def scan(self):
+        """Lists the files of the source directory.
+
+        Returns:
+            dirs (list): Paths of all directories of the tree, to be watched.
+        """
+
+        listing = {}
+        files = prep.walk_dir(self.src_dir, ".", self.listing, listing)
+        self.listing = listing
+        self.files = [f for f in files if f.endswith(self.suffixes)]
+        self.debouncer.add(
+            f for f in self.files if f not in self.processed and f not in self.ignored
+        )
+
+        return [os.path.normpath(os.path.join(self.src_dir, key)) for key in listing]
+
+    def new_files(self):
+        """Returns the new files which are written completely.
+
+        They are marked as processed.
+        """
+
+        ready = self.debouncer.ready()
+        self.processed.update(ready)
+
+        return ready
+
+    def current_files(self):
+        """Returns all processed files which still exist."""
+
+        return [f for f in self.files if f in self.processed]
+
+    def ignore(self, files):
+        """Never processes the files, e.g. results written to the source directory."""
+
+        for f in files:
+            self.ignored.add(f)
+            self.debouncer.pending.pop(f, None)
+
+    def is_pending(self):
+        """Checks if files are held back by the debouncer."""
+
+        return bool(self.debouncer.pending)
+
+
+def watch(folders, process, interval=10, log=None):
+    """Processes new files of the folders until the process is interrupted.
+
+    Args:
+        folders (list): Folder objects of the source directories.
+        process (function): Called with a folder and the list of its new
+                            files, whenever files are ready.
+        interval (float): Seconds between scans of folders which are polled.
+        log (function): Called with a message when the watching starts.
+    """
+
+    mon = monitor([folder.src_dir for folder in folders])
+    if log is not None:
+        log(">>> Watching {0} folders, {1}".format(len(folders), type(mon).__name__))
+
+    try:
+        while True:
+            for folder in folders:
+                for path in folder.scan():
+                    mon.add(path)
+                new_fs = folder.new_files()
+                if new_fs:
+                    process(folder, new_fs)
+
+            # Pending files are checked again after the settle time
+            timeout = interval
+            for folder in folders:
+                if folder.is_pending():
+                    timeout = min(timeout, folder.debouncer.settle)
+            mon.wait(timeout)
+    finally:
+        mon.close()
@@ -0,0 +1,374 @@
+"""proespm_benchmark.py
+
+Run this file to measure the speed of proespm with large synthetic files.
+
+For each importer a large file is generated from the reference file of its
+format. The import time, the peak memory and the time of the html report
+of the item are measured in a separate process. SPM processing and image
+export are measured with large arrays. The results can be saved as
+baseline, later runs are compared with it:
+
+    $ python2 proespm_benchmark.py --save
+    $ python2 proespm_benchmark.py --tolerance 1.2
+
+Each benchmark is run three times and the best result counts, as the
+times of other processes on the computer only add up.
+
+With --scaling, the Biologic CV import is measured for an increasing
+number of cycles, e.g. to check that the import time scales linearly.
+
+(C) Copyright Nicolas Bock, licensed under GPL v3
+See LICENSE or http://www.gnu.org/licenses/gpl-3.0.html
+"""
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+dirname = os.path.dirname(os.path.abspath(__file__))
+path = os.path.join(dirname, "../proespm/")
+sys.path.insert(0, path)
+
+import numpy as np
+import ec
+import spectroscopy
+import topo
+import render
+import timing
+import html
+
+
+ref_dir = os.path.join(dirname, "reference_files/data")
+baseline_file = os.path.join(dirname, "benchmark_baseline.json")
+
+# Name, class, reference file, header lines (None: mpt header), data rows
+importers = [
+    ("cv_ec4", "Cv", "cv_ec4/CV_162437_ 1.txt", 96, 500000),
+    ("cv_labview", "Cv", "cv_labview/test_001.lvm", 22, 500000),
+    ("cv_biologic", "Cv", "cv_biologic/a__02_CV_C02.mpt", None, 500000),
+    ("peis_biologic", "Peis", "peis_biologic/a__01_PEIS_C02.mpt", None, 200000),
+    ("chrono_biologic", "Chrono", "chrono_biologic/11_02_CA_C02.mpt", None, 500000),
+    ("raman", "Raman", "raman/MK19_autoclave.txt", 1, 500000),
+    ("xps_e20", "Xps", "xps_e20/448.dat", 0, 500000),
+    ("xps_phi", "Xps", "xps_phi/xps_phi.csv", 4, 500000),
+]
+classes = {
+    "Cv": ec.Cv,
+    "Peis": ec.Peis,
+    "Chrono": ec.Chrono,
+    "Raman": spectroscopy.Raman,
+    "Xps": spectroscopy.Xps,
+}
+# Labjournal entry of the items, as shown in the report
+meta = {
+    "surface": "Au(111)",
+    "electrolyte": "H2SO4",
+    "gas": "Ar",
+    "re": "RHE",
+    "ce": "Pt",
+    "remark": "benchmark",
+}
+# Edge length of the SPM arrays in pixels
+spm_sizes = [512, 2048]
+
+
+def read_header(ref_file):
+    """Returns the header lines of a reference Biologic mpt file.
+
+    Args:
+        ref_file (str): Path to the reference file.
+    """
+
+    with open(ref_file) as f:
+        lines = f.readlines()
+    n_header = int(lines[1].split(":")[1])
+
+    return lines[:n_header]
+
+
+def write_biologic_cv(m_file, cycles, points):
+    """Writes a synthetic Biologic CV file.
+
+    Args:
+        m_file (str): Path of the file which will be written.
+        cycles (int): Number of CV cycles.
+        points (int): Number of data points per cycle.
+    """
+
+    header = read_header(os.path.join(ref_dir, "cv_biologic/a__02_CV_C02.mpt"))
+    n = cycles * points
+    data = np.zeros((n, 13))
+    phase = np.linspace(0, 2 * np.pi, points)
+    data[:, 5] = np.arange(n) * 0.03
+    data[:, 7] = np.tile(np.sin(phase), cycles)
+    data[:, 8] = np.tile(np.cos(phase), cycles) * 1e-3
+    data[:, 9] = np.repeat(np.arange(1, cycles + 1), points)
+
+    with open(m_file, "w") as f:
+        f.writelines(header)
+        np.savetxt(f, data, fmt="%.9E", delimiter="\t")
+
+
+def write_repeated(m_file, ref_file, n_header, rows):
+    """Writes a large file with the header of a reference file.
+
+    The data lines of the reference file are repeated until the file has
+    the given number of rows.
+
+    Args:
+        m_file (str): Path of the file which will be written.
+        ref_file (str): Path to the reference file.
+        n_header (int): Number of header lines, None: mpt header.
+        rows (int): Number of data rows.
+    """
+
+    # Binary, the headers contain e.g. cp1252 characters
+    with open(ref_file, "rb") as f:
+        lines = f.readlines()
+    if n_header is None:
+        n_header = int(lines[1].split(b":")[1])
+    data = [x for x in lines[n_header:] if x.strip()]
+
+    with open(m_file, "wb") as f:
+        f.writelines(lines[:n_header])
+        for _ in range(rows // len(data)):
+            f.writelines(data)
+        f.writelines(data[: rows % len(data)])
+
+
+def write_input(tmp_dir, name, ref_file, n_header, rows):
+    """Writes the synthetic file of an importer and returns its path."""
+
+    m_file = os.path.join(tmp_dir, os.path.basename(ref_file))
+    if name == "cv_biologic":
+        write_biologic_cv(m_file, 5, rows // 5)
+    else:
+        write_repeated(m_file, os.path.join(ref_dir, ref_file), n_header, rows)
+
+    return m_file
+
+
+def bench_importer(tmp_dir, case, report=True):
+    """Imports a synthetic file and writes the html report of the item.
+
+    Runs in a separate process, so the peak memory is the one of the case.
+
+    Args:
+        tmp_dir (str): Folder of the synthetic files.
+        case (tuple): Entry of importers.
+        report (bool): False: only measure the import.
+
+    Returns:
+        result (dict): Times in seconds and peak memory growth in MB.
+    """
+
+    name, cls_name, ref_file, n_header, rows = case
+    m_file = write_input(tmp_dir, name, ref_file, n_header, rows)
+    rss = timing.peak_rss()
+
+    start = time.time()
+    item = classes[cls_name](m_file, **meta)
+    result = {"import": time.time() - start}
+    if report:
+        start = time.time()
+        html.create_html(tmp_dir, tmp_dir, [item])
+        result["report"] = time.time() - start
+    if rss is not None:
+        result["memory"] = timing.peak_rss() - rss
+    os.remove(m_file)
+
+    return result
+
+
+def bench_spm(size):
+    """Processes and exports a synthetic topography, see bench_importer."""
+
+    z = np.random.RandomState(size).normal(size=(size, size)).cumsum(axis=0)
+    png_file = os.path.join(tempfile.mkdtemp(), "bench_tf.png")
+    rss = timing.peak_rss()
+
+    start = time.time()
+    z = topo.process(z, ["level", "align_rows", "fix_zero"])
+    result = {"process": time.time() - start}
+    start = time.time()
+    scale = render.color_scale(z)
+    render.save_png(z, png_file, scale=scale)
+    render.save_thumbnail(z, png_file, 256, scale=scale)
+    result["export"] = time.time() - start
+    if rss is not None:
+        result["memory"] = timing.peak_rss() - rss
+    shutil.rmtree(os.path.dirname(png_file))
+
+    return result
+
+
+def isolated(func, *args):
+    """Runs a function in a new process and returns its result."""
+
+    pool = multiprocessing.Pool(processes=1)
+    try:
+        return pool.apply(func, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def best_of(repeat, func, *args):
+    """Runs a benchmark several times and returns the minimum of each measure."""
+
+    runs = [isolated(func, *args) for _ in range(repeat)]
+
+    return {k: min(run[k] for run in runs) for k in runs[0]}
+
+
+def run_suite(tmp_dir, report=True, repeat=1):
+    """Runs all benchmarks.
+
+    Args:
+        tmp_dir (str): Folder of the synthetic files.
+        report (bool): False: do not measure the html report.
+        repeat (int): Number of runs of each benchmark.
+
+    Returns:
+        results (dict): Results by name of the benchmark.
+    """
+
+    results = {}
+    for case in importers:
+        results[case[0]] = best_of(repeat, bench_importer, tmp_dir, case, report)
+        results[case[0]]["rows"] = case[4]
+    for size in spm_sizes:
+        results["spm_{0}".format(size)] = best_of(repeat, bench_spm, size)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints the results next to the baseline.
+
+    Args:
+        results (dict): Results by name of the benchmark.
+        baseline (dict): Results of the baseline, may be empty.
+        tolerance (float): Ratio to the baseline above which a time is
+                           reported as regression.
+
+    Returns:
+        regressions (list): Names and measures which are slower.
+    """
+
+    regressions = []
+    print(
+        "{0:<16} {1:<8} {2:>10} {3:>10} {4:>8}".format(
+            "benchmark", "measure", "value", "baseline", "ratio"
+        )
+    )
+    for name in sorted(results):
+        for measure in sorted(results[name]):
+            if measure == "rows":
+                continue
+            value = results[name][measure]
+            base = baseline.get(name, {}).get(measure)
+            ratio = value / base if base else float("nan")
+            flag = ""
+            if measure != "memory" and base and ratio > tolerance:
+                regressions.append(name + " " + measure)
+                flag = " slower"
+            print(
+                "{0:<16} {1:<8} {2:>10.3f} {3:>10} {4:>8.2f}{5}".format(
+                    name,
+                    measure,
+                    value,
+                    "-" if base is None else "{0:.3f}".format(base),
+                    ratio,
+                    flag,
+                )
+            )
+
+    return regressions
+
+
+def bench_cv_biologic(tmp_dir, points=200):
+    """Import time of Biologic CV files with an increasing number of cycles."""
+
+    print("Biologic CV import ({0} points per cycle)".format(points))
+    print(
+        "{0:>8} {1:>10} {2:>10} {3:>12}".format(
+            "cycles", "rows", "time [s]", "us / row"
+        )
+    )
+    for cycles in [125, 250, 500, 1000]:
+        m_file = os.path.join(tmp_dir, "bench_{0}_CV_C01.mpt".format(cycles))
+        write_biologic_cv(m_file, cycles, points)
+        start = time.time()
+        ec.Cv(m_file)
+        t = time.time() - start
+        rows = cycles * points
+        print(
+            "{0:>8} {1:>10} {2:>10.3f} {3:>12.2f}".format(
+                cycles, rows, t, 1e6 * t / rows
+            )
+        )
+
+
+def parse_args():
+    """Parses the command line arguments."""
+
+    parser = argparse.ArgumentParser(description="Benchmarks of proespm.")
+    parser.add_argument(
+        "--baseline", default=baseline_file, help="path of the baseline JSON file"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as new baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.2,
+        help="ratio to the baseline time above which the exit code is 1",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs of each benchmark, the best counts"
+    )
+    parser.add_argument(
+        "--no-report", action="store_true", help="do not measure the html report"
+    )
+    parser.add_argument(
+        "--scaling", action="store_true", help="only run the CV import scaling"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # The report templates are loaded from the working directory
+    os.chdir(path)
+    tmp = tempfile.mkdtemp(prefix="proespm_", suffix="_bench")
+    try:
+        if args.scaling:
+            bench_cv_biologic(tmp)
+            sys.exit(0)
+
+        res = run_suite(tmp, not args.no_report, args.repeat)
+    finally:
+        shutil.rmtree(tmp)
+
+    try:
+        with open(args.baseline) as f:
+            base_res = json.load(f)
+    except (IOError, ValueError):
+        base_res = {}
+    slower = compare(res, base_res, args.tolerance)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(res, f, indent=2, sort_keys=True)
+        print("Baseline saved to " + args.baseline)
+    elif slower:
+        print("Slower than the baseline: " + ", ".join(slower))
+        sys.exit(1)
@@ -25,14 +25,21 @@ import gwyutils
 import unittest
 import re
 import shutil
+import tempfile
+import time
 import config
 import html
+import gwyddion
 import prep
 import spm
+import topo
+import render
+import zlib
 import data
 import ec
 import spectroscopy
 import numpy as np
+import pandas
 from shutil import copy2, move
 from itertools import count
 from os.path import dirname, abspath, join
@@ -68,6 +75,92 @@ class labjournalTest(unittest.TestCase):
         self.assertEqual(self.labjournal["ID"][1], "CV_164101_ 2")
 
 
+class labjournalIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.labjournal = pandas.DataFrame(
+            {
+                "ID": [271, 271.0, "CV_162437_ 1", np.nan],
+                "type": ["stm", "ecstm", "cv", "cv"],
+            }
+        )
+        self.index, self.duplicates = prep.index_labjournal(self.labjournal)
+
+    def testIdsAreNormalized(self):
+        self.assertEqual(sorted(self.index.keys()), ["271", "CV_162437_ 1"])
+
+    def testFirstDuplicateIsUsed(self):
+        self.assertEqual(self.index["271"]["type"], "stm")
+        self.assertEqual(self.duplicates, ["271"])
+
+
+class findFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for d in ["a/b", "_png", "c/_data"]:
+            os.makedirs(join(self.folder, d))
+        for f in ["x.SM4", "a/1.mpt", "a/b/2.txt", "_png/3.png", "c/_data/4.txt"]:
+            open(join(self.folder, f), "w").close()
+        self.old = int(time.time()) - 3600
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testUnderscoreFoldersAreSkipped(self):
+        input_fs = prep.find_files(self.folder, ["SM4", "mpt", "txt", "png"], 2)
+        self.assertEqual(
+            sorted(os.path.relpath(f, self.folder) for f in input_fs),
+            [join("a", "1.mpt"), join("a", "b", "2.txt"), "x.SM4"],
+        )
+
+    def backdate(self, *dirs):
+        # Directories modified just before they are listed are always listed again
+        for d in dirs:
+            os.utime(join(self.folder, d), (self.old, self.old))
+
+    def testListingIsStored(self):
+        self.backdate(".", "a", "a/b", "c")
+        prep.find_files(self.folder, ["txt"])
+        self.assertTrue(os.path.isfile(join(self.folder, prep.listing_name)))
+        open(join(self.folder, "a", "b", "5.txt"), "w").close()
+        self.backdate("a/b")
+        self.assertEqual(len(prep.find_files(self.folder, ["txt"])), 1)
+        os.utime(join(self.folder, "a", "b"), None)
+        self.assertEqual(len(prep.find_files(self.folder, ["txt"])), 2)
+
+    def testNonAsciiNamesAreStored(self):
+        open(join(self.folder, "a", "\xe4.txt"), "w").close()
+        self.backdate(".", "a", "a/b", "c")
+        first = prep.find_files(self.folder, ["txt"])
+        self.assertEqual(prep.find_files(self.folder, ["txt"]), first)
+        self.assertIn(join(self.folder, "a", "\xe4.txt"), first)
+
+
+class paginateTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.items = []
+        for name, dt in [
+            ("1.txt", "2019-11-27 09:00:00"),
+            ("2.txt", "2019-11-27 17:30:00"),
+            ("3.txt", "2019-11-28 08:15:00"),
+        ]:
+            open(join(self.folder, name), "w").close()
+            item = data.Data(join(self.folder, name))
+            item.datetime = dt
+            self.items.append(item)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testPagePerDay(self):
+        pages = [(k, len(list(v))) for k, v in html.paginate(self.items, "day")]
+        self.assertEqual(pages, [("2019-11-27", 2), ("2019-11-28", 1)])
+
+    def testItemsPerPage(self):
+        pages = [(k, len(list(v))) for k, v in html.paginate(self.items, 2)]
+        self.assertEqual(pages, [("001", 2), ("002", 1)])
+
+
 class nidStmTest(unittest.TestCase):
     def setUp(self):
         self.dirname = os.path.abspath(os.path.dirname(__file__))
@@ -195,5 +288,147 @@ class cvTest(unittest.TestCase):
     pass
 
 
+class decimateTest(unittest.TestCase):
+    def setUp(self):
+        self.y = np.sin(np.linspace(0, 50, 100001))
+        self.y[12345] = 5.0
+
+    def testNumberOfPoints(self):
+        self.assertLessEqual(len(ec.decimate(self.y, 1000)), 1000)
+
+    def testPeakIsKept(self):
+        self.assertIn(12345, ec.decimate(self.y, 1000))
+
+    def testShortTraceIsNotReduced(self):
+        self.assertEqual(len(ec.decimate(self.y[:100], 1000)), 100)
+
+
+class traceTest(unittest.TestCase):
+    def setUp(self):
+        values = np.array([[1.0, 2.0, 3.0, 4.0, 5.0], [10, 20, 30, 40, 50]])
+        numbers = np.array([0, 2, 1, 2, 1])
+        self.trace = ec.Trace.from_cycles(["Ecell", "Icell"], values, numbers, 2)
+
+    def testCyclesAreSorted(self):
+        self.assertEqual(self.trace.cycle("Cycle 2")["Ecell"].tolist(), [2.0, 4.0])
+
+    def testCycleIsView(self):
+        cycle = self.trace.cycle("Cycle 1")
+        self.assertTrue(np.shares_memory(cycle.values, self.trace.values))
+
+    def testFrameColumns(self):
+        frame = self.trace.frame("{cycle}: {channel}")
+        self.assertEqual(frame["Cycle 1: Icell"].tolist(), [30.0, 50.0])
+
+
+class topoTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.y, self.x = np.mgrid[0:64, 0:80]
+        self.noise = rng.normal(size=(64, 80)) * 1e-3
+        self.offsets = rng.normal(size=(64, 1))
+
+    def testPlaneIsRemoved(self):
+        z = self.noise + 0.3 * self.x + 0.2 * self.y + 5
+        self.assertLess(np.std(topo.plane_level(z)), 2e-3)
+
+    def testRowOffsetsAreRemoved(self):
+        z = self.noise + self.offsets
+        for method in [0, 1, 2]:
+            self.assertLess(np.std(topo.align_rows(z, 0, method)), 1e-2)
+
+    def testMaskedPixelsAreExcluded(self):
+        z = self.noise + self.offsets
+        z[:, :10] += 100
+        mask = np.zeros(z.shape, dtype=bool)
+        mask[:, :10] = True
+        aligned = topo.align_rows(z, 0, 0, topo.mask_exclude, mask)
+        self.assertLess(np.std(aligned[:, 10:]), 2e-3)
+
+    def testMedianBackgroundKeepsSpikes(self):
+        z = np.ones((32, 32))
+        z[10, 10] = 50
+        leveled = topo.median_background(z, 3)
+        self.assertEqual(leveled[10, 10], 49)
+        self.assertEqual(np.count_nonzero(leveled), 1)
+
+    def testFixZero(self):
+        self.assertEqual(topo.fix_zero(self.noise).min(), 0)
+
+
+class topoGwyddionTest(unittest.TestCase):
+    def setUp(self):
+        self.input_file = join(src_dir, "easyscan/Image00037.nid")
+        self.item = spm.Stm(self.input_file)
+        self.ch = self.item.topo_fwd_ch[0]
+        self.z = np.array(self.item.convert_np(self.ch[0]))
+
+    def testNumpyEngineMatchesGwyddion(self):
+        self.item.process_topo(self.ch)
+        z_gwy = np.array(self.item.convert_np(self.ch[0]))
+        z_np = topo.process(self.z, config.run_gwy_immediate_func)
+        tolerance = 1e-3 * np.ptp(z_gwy)
+        self.assertLess(
+            np.abs((z_np - z_np.mean()) - (z_gwy - z_gwy.mean())).max(), tolerance
+        )
+
+
+class NoPointerField(gwy.DataField):
+    """Data field as in Gwyddion bindings without get_data_pointer."""
+
+    get_data_pointer = None
+
+
+class gwyFieldTest(unittest.TestCase):
+    def setUp(self):
+        self.z = np.random.RandomState(0).normal(size=(16, 16))
+
+    def testSetFieldData(self):
+        field = gwy.DataField(16, 16, 1.0, 1.0, True)
+        gwyddion.set_field_data(field, self.z)
+        self.assertTrue(np.array_equal(gwyddion.field_array(field), self.z))
+
+    def testSetFieldDataWithoutPointer(self):
+        field = NoPointerField(16, 16, 1.0, 1.0, True)
+        gwyddion.set_field_data(field, self.z)
+        self.assertTrue(np.array_equal(gwyddion.field_array(field), self.z))
+
+
+class renderTest(unittest.TestCase):
+    def setUp(self):
+        self.z = np.random.RandomState(0).normal(size=(40, 60))
+
+    def testGrayLut(self):
+        lut = render.gradient_lut("Gray")
+        self.assertEqual(lut.shape, (256, 3))
+        self.assertEqual(lut[0].tolist(), [0, 0, 0])
+        self.assertEqual(lut[255].tolist(), [255, 255, 255])
+
+    def testFullRangeUsesAllColors(self):
+        index = render.color_index(self.z, render.range_full)
+        self.assertEqual((index.min(), index.max()), (0, 255))
+
+    def testAdaptiveRangeEqualizesHistogram(self):
+        index = render.color_index(self.z, render.range_adaptive)
+        counts = np.bincount(index.ravel(), minlength=256)
+        self.assertLessEqual(counts.max() - counts.min(), 2)
+
+    def testDownsampleAveragesBlocks(self):
+        z_thumb = render.downsample(self.z, 16)
+        self.assertEqual(z_thumb.shape, (3, 4))
+        self.assertAlmostEqual(z_thumb[0, 0], self.z[:16, :16].mean())
+
+    def testPngContent(self):
+        rgb = render.render(self.z, render.range_auto, "Gold")
+        png = render.encode_png(rgb)
+        self.assertEqual(png[:8], b"\x89PNG\r\n\x1a\n")
+        idat = png.index(b"IDAT")
+        length = int(np.frombuffer(png[idat - 4 : idat], dtype=">u4")[0])
+        lines = np.frombuffer(
+            zlib.decompress(png[idat + 4 : idat + 4 + length]), dtype=np.uint8
+        ).reshape(40, 181)
+        self.assertTrue((lines[:, 1:].reshape(rgb.shape) == rgb).all())
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)